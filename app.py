@@ -1,31 +1,152 @@
+import threading
+import click
 from flask import Flask, render_template
-from models.models import db, create_admin, create_sample_data, to_ist_str
-from controllers.user_controller import user_bp
-from controllers.admin_controller import admin_bp
-from controllers.parking_controller import parking_bp
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = '23f2001216'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///park.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = '23f2001216'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///park.db'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['REPORT_DIR'] = 'reports'
+    app.config['EVENT_LOG_DIR'] = None
+    app.config['SQLITE_JOURNAL_MODE'] = 'WAL'
+    if config:
+        app.config.update(config)
 
-db.init_app(app)
+    from models.models import db, set_sqlite_pragmas
+    from models.event_log import init_event_log
+    from models.shards import check_shards, route_request_to_shard
+    db.init_app(app)
+    with app.app_context():
+        check_shards(db)
+        for engine in db.engines.values():
+            set_sqlite_pragmas(engine, app.config['SQLITE_JOURNAL_MODE'])
+    init_event_log(app)
+    app.before_request(route_request_to_shard)
+    defer_blueprints(app)
+    register_commands(app)
 
-app.register_blueprint(user_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(parking_bp)
+    @app.route('/')
+    def index():
+        return render_template('index.html')
 
-@app.route('/')
-def index():
-    return render_template('index.html')
+    @app.template_filter('ist')
+    def ist_time(dt, fmt='%Y-%m-%d %H:%M'):
+        from flask import session
+        from models.timefmt import format_local
+        return format_local(dt, fmt, session.get('timezone'))
 
-@app.template_filter('ist')
-def ist_time(dt, fmt='%Y-%m-%d %H:%M'):
-    return to_ist_str(dt, fmt)
+    return app
 
-if __name__ == '__main__':
-    with app.app_context():
+def defer_blueprints(app):
+    # The controllers are imported and registered by the first request rather
+    # than in create_app, so CLI commands and a worker that has not served yet
+    # never load them. Code that builds URLs outside a request (there is none
+    # today) has to call register_blueprints(app) itself.
+    lock = threading.Lock()
+    wsgi_app = app.wsgi_app
+    registered = []
+
+    def first_request(environ, start_response):
+        if not registered:
+            with lock:
+                if not registered:
+                    register_blueprints(app)
+                    registered.append(True)
+        return wsgi_app(environ, start_response)
+
+    app.wsgi_app = first_request
+
+def register_blueprints(app):
+    from controllers.user_controller import user_bp
+    from controllers.admin_controller import admin_bp
+    from controllers.parking_controller import parking_bp
+    app.register_blueprint(user_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(parking_bp)
+
+def register_commands(app):
+    @app.cli.command('init-db')
+    def init_db():
+        from models.models import db, create_admin, create_sample_data, upgrade_schema
+        from models.event_log import current_event_log, replay_all
+        from models.shards import create_shard_tables
         db.create_all()
+        create_shard_tables(db)
+        for change in upgrade_schema():
+            print(f'Added {change}')
         create_admin()
         create_sample_data()
-    app.run(debug=True)
\ No newline at end of file
+        if current_event_log():
+            replay_all()
+        print('Database initialized')
+
+    @app.cli.command('export-reports')
+    def export_reports():
+        from models.reports import export_snapshot
+        exported = export_snapshot(app.config['REPORT_DIR'])
+        print(f'Exported {exported} reservations to {app.config["REPORT_DIR"]}')
+
+    @app.cli.command('replay-events')
+    def replay_events_command():
+        from models.event_log import replay_all
+        applied = replay_all()
+        print(f'Replayed {applied} reservation events')
+
+    @app.cli.command('refresh-forecasts')
+    @click.option('--every', type=float, default=None,
+                  help='Keep running as a batch job, refreshing every N seconds.')
+    def refresh_forecasts_command(every):
+        import time
+        from models.models import db
+        from models.forecast import refresh_forecasts
+        while True:
+            processed = refresh_forecasts()
+            db.session.remove()
+            print(f'Folded {processed} reservations into lot forecasts', flush=True)
+            if every is None:
+                break
+            time.sleep(every)
+
+    @app.cli.command('snapshot-replica')
+    @click.argument('bind')
+    @click.option('--every', type=float, default=None,
+                  help='Keep running, refreshing every N seconds (keep it below REPLICA_MAX_LAG).')
+    def snapshot_replica(bind, every):
+        # Refreshes a file-backed SQLite replica with an online backup of the
+        # primary; the heartbeat written first dates the copy, and the monitor
+        # takes the replica out of rotation once that is REPLICA_MAX_LAG old.
+        import sqlite3
+        import time
+        from models.models import db
+        from models.replicas import write_heartbeat
+        engine = db.engines[bind]
+        while True:
+            write_heartbeat(db)
+            engine.dispose()
+            source = db.engine.raw_connection()
+            target = sqlite3.connect(engine.url.database)
+            try:
+                source.driver_connection.backup(target)
+            finally:
+                target.close()
+                source.close()
+            print(f'Replica {bind} refreshed from the primary', flush=True)
+            if every is None:
+                break
+            time.sleep(every)
+
+    @app.cli.command('replica-heartbeat')
+    @click.option('--every', type=float, default=1.0, help='Seconds between heartbeats.')
+    def replica_heartbeat(every):
+        # For replicas kept current outside the app (e.g. streaming
+        # replication): their lag is the age of the last heartbeat they have.
+        import time
+        from models.models import db
+        from models.replicas import write_heartbeat
+        while True:
+            write_heartbeat(db)
+            time.sleep(every)
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
@@ -0,0 +1,101 @@
+"""Booking event throughput with and without group commit.
+
+Usage: python benchmarks/group_commit.py [threads] [events_per_thread]
+Each append waits until its event is fsynced, like a booking request would.
+The second run goes through the real /book_lot and /release_spot endpoints
+on a file database, where the append also has to fit around SQLite's
+write lock.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models.event_log import ReservationEventLog
+from models.models import db, create_admin, create_sample_data, User, Vehicle
+
+def run(group_commit, threads, per_thread):
+    with tempfile.TemporaryDirectory() as tmp:
+        log = ReservationEventLog(tmp, group_commit=group_commit)
+        event = {'type': 'book', 'reservation_id': 1, 'spot_id': 1, 'user_id': 1, 'vehicle_id': 1,
+            'parking_timestamp': '2025-11-10T10:00:00', 'leaving_timestamp': None, 'parking_cost': 50.0}
+
+        def worker():
+            for _ in range(per_thread):
+                log.append(event)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        log.close()
+    return threads * per_thread / elapsed
+
+def run_bookings(group_commit, threads, per_thread):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'bench.db'),
+            'EVENT_LOG_DIR': os.path.join(tmp, 'event_log'),
+            'EVENT_LOG_GROUP_COMMIT': group_commit,
+            'SECRET_KEY': 'bench'
+        })
+        with app.app_context():
+            db.create_all()
+            create_admin()
+            create_sample_data()
+            users = [User(username=f'booker{i}', email=f'booker{i}@test.com', password_hash='-') for i in range(threads)]
+            db.session.add_all(users)
+            db.session.flush()
+            vehicles = [Vehicle(user_id=user.id, vehicle_number=f'GRP{i:05d}', vehicle_type='Car') for i, user in enumerate(users)]
+            db.session.add_all(vehicles)
+            db.session.commit()
+            people = [(user.id, vehicle.id) for user, vehicle in zip(users, vehicles)]
+        failed = []
+
+        def worker(user_id, vehicle_id):
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+            for _ in range(per_thread):
+                booked = client.post('/book_lot/2', json={'vehicle_id': vehicle_id})
+                if booked.status_code != 200:
+                    failed.append(booked.status_code)
+                    continue
+                client.post(f"/release_spot/{booked.get_json()['reservation_id']}")
+
+        workers = [threading.Thread(target=worker, args=person) for person in people]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        app.extensions['event_log'].close()
+        with app.app_context():
+            db.engine.dispose()
+    return threads * per_thread / elapsed, len(failed)
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    single = run(False, threads, per_thread)
+    grouped = run(True, threads, per_thread)
+    print(f'{threads} threads x {per_thread} events')
+    print(f'fsync per event: {single:.0f} events/s')
+    print(f'group commit:    {grouped:.0f} events/s ({grouped / single:.1f}x)')
+    bookings = max(per_thread // 10, 1)
+    single, single_failed = run_bookings(False, threads, bookings)
+    grouped, grouped_failed = run_bookings(True, threads, bookings)
+    print(f'{threads} threads x {bookings} book+release through /book_lot')
+    print(f'fsync per event: {single:.1f} book+release/s, {single_failed} failed')
+    print(f'group commit:    {grouped:.1f} book+release/s, {grouped_failed} failed ({grouped / single:.1f}x)')
+
+if __name__ == '__main__':
+    main()
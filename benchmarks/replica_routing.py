@@ -0,0 +1,120 @@
+"""Booking latency under heavy report traffic, with and without a replica.
+
+Usage: python benchmarks/replica_routing.py [report_workers] [bookings]
+Report workers (separate processes, as separate app workers would be) loop
+over the admin summary and CSV export while one client books and releases
+spots. The same run is done with everything on the primary and with a
+snapshot replica bound for the read-only views.
+"""
+import os
+import sys
+import tempfile
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models.models import db, create_admin, create_sample_data, User, Vehicle, Reservation, ParkingSpot
+
+HISTORY = 20000
+
+def make_app(tmp, with_replica):
+    config = {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'primary.db'),
+        'EVENT_LOG_DIR': None,
+        'SECRET_KEY': 'bench'
+    }
+    if with_replica:
+        config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:///' + os.path.join(tmp, 'replica.db')}
+    return create_app(config)
+
+def build(tmp, with_replica):
+    app = make_app(tmp, with_replica)
+    with app.app_context():
+        db.create_all()
+        create_admin()
+        create_sample_data()
+        user = User(username='booker', email='booker@test.com', password_hash='-')
+        db.session.add(user)
+        db.session.flush()
+        vehicle = Vehicle(user_id=user.id, vehicle_number='BOOK0001', vehicle_type='Car')
+        db.session.add(vehicle)
+        db.session.flush()
+        spot_ids = [spot_id for spot_id, in db.session.query(ParkingSpot.id)]
+        start = datetime(2025, 1, 1)
+        db.session.execute(db.insert(Reservation), [
+            {'spot_id': spot_ids[i % len(spot_ids)], 'user_id': user.id, 'vehicle_id': vehicle.id, 'parking_cost': 50.0,
+             'parking_timestamp': start + timedelta(hours=i), 'leaving_timestamp': start + timedelta(hours=i + 2)}
+            for i in range(HISTORY)
+        ])
+        db.session.commit()
+        ids = (user.id, vehicle.id, User.query.filter_by(username='admin').first().id)
+        if with_replica:
+            app.test_cli_runner().invoke(args=['snapshot-replica', 'replica'])
+    return app, ids
+
+def client_for(app, user_id, is_admin=False):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['is_admin'] = is_admin
+    return client
+
+def report_worker(tmp, with_replica, admin_id, ready, stop, served):
+    client = client_for(make_app(tmp, with_replica), admin_id, is_admin=True)
+    ready.release()
+    while not stop.is_set():
+        client.get('/admin/summary')
+        client.get('/admin/export_summary')
+        with served.get_lock():
+            served.value += 2
+
+def run(with_replica, report_workers, bookings):
+    with tempfile.TemporaryDirectory() as tmp:
+        app, (user_id, vehicle_id, admin_id) = build(tmp, with_replica)
+        context = multiprocessing.get_context('spawn')
+        ready = context.Semaphore(0)
+        stop = context.Event()
+        served = context.Value('i', 0)
+        workers = [
+            context.Process(target=report_worker, args=(tmp, with_replica, admin_id, ready, stop, served))
+            for _ in range(report_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.acquire()
+        booker = client_for(app, user_id)
+        latencies = []
+        for _ in range(bookings):
+            start = time.perf_counter()
+            booked = booker.post('/book_lot/1', json={'vehicle_id': vehicle_id}).get_json()
+            booker.post(f"/release_spot/{booked['reservation_id']}")
+            latencies.append(time.perf_counter() - start)
+            # Let the pin from this write lapse, as it would between real users.
+            with booker.session_transaction() as sess:
+                sess.pop('primary_until', None)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose()
+        if with_replica:
+            db.metadatas.pop('replica', None)
+    latencies.sort()
+    return latencies, served.value
+
+def main():
+    report_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    bookings = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    for with_replica in (False, True):
+        latencies, reports = run(with_replica, report_workers, bookings)
+        label = 'replica' if with_replica else 'primary only'
+        print(f'{label:>12}: book+release p50 {latencies[len(latencies) // 2] * 1000:6.1f}ms, '
+              f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.1f}ms, {reports} report pages served')
+
+if __name__ == '__main__':
+    main()
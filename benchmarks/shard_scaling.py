@@ -0,0 +1,117 @@
+"""Booking write throughput as lots are spread over more SQLite shards.
+
+Usage: python benchmarks/shard_scaling.py [writers] [seconds] [shards ...]
+Writer processes book and release spots through the real endpoints, each on
+a lot of its own, while the admin's lots are spread by create_lot over 1, 2
+and 4 databases (the primary plus shard binds, see models/shards.py).
+Shards only pay off once the single SQLite write lock is the bottleneck;
+with fewer cores than writers, request handling itself is the limit.
+"""
+import os
+import sys
+import tempfile
+import multiprocessing
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models.models import db, create_admin, ParkingLot, User, Vehicle
+from models.shards import create_shard_tables, fan_out_rows, shard_of
+
+SPOTS_PER_LOT = 10
+
+def make_app(tmp, shards):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'primary.db'),
+        'SQLALCHEMY_BINDS': {f'shard{k}': 'sqlite:///' + os.path.join(tmp, f'shard{k}.db') for k in range(1, shards)},
+        'EVENT_LOG_DIR': None,
+        'SECRET_KEY': 'bench'
+    })
+
+def client_for(app, user_id, is_admin=False):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['is_admin'] = is_admin
+    return client
+
+def build(tmp, shards, writers):
+    app = make_app(tmp, shards)
+    with app.app_context():
+        db.create_all()
+        create_shard_tables(db)
+        create_admin()
+        users = [User(username=f'writer{i}', email=f'writer{i}@test.com', password_hash='-') for i in range(writers)]
+        db.session.add_all(users)
+        db.session.flush()
+        vehicles = [Vehicle(user_id=user.id, vehicle_number=f'WRT{i:05d}', vehicle_type='Car') for i, user in enumerate(users)]
+        db.session.add_all(vehicles)
+        db.session.commit()
+        people = [(user.id, vehicle.id) for user, vehicle in zip(users, vehicles)]
+        admin_id = User.query.filter_by(username='admin').first().id
+        db.session.remove()
+    admin = client_for(app, admin_id, is_admin=True)
+    for i in range(writers):
+        admin.post('/admin/create_lot', data={
+            'name': f'Lot {i}', 'address': '-', 'pin_code': '000000', 'price': '50', 'spots': str(SPOTS_PER_LOT)
+        })
+    with app.app_context():
+        lot_ids = sorted(lot.id for lot in fan_out_rows(db, lambda: ParkingLot.query.all()))
+        for engine in db.engines.values():
+            engine.dispose()
+    return people, lot_ids
+
+def writer(tmp, shards, user_id, vehicle_id, lot_id, ready, go, deadline, done, errors):
+    client = client_for(make_app(tmp, shards), user_id)
+    ready.release()
+    go.wait()
+    while time.time() < deadline.value:
+        booked = client.post(f'/book_lot/{lot_id}', json={'vehicle_id': vehicle_id})
+        if booked.status_code != 200:
+            with errors.get_lock():
+                errors.value += 1
+            continue
+        released = client.post(f"/release_spot/{booked.get_json()['reservation_id']}")
+        with done.get_lock():
+            done.value += 1
+            errors.value += released.status_code != 200
+
+def run(shards, writers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        people, lot_ids = build(tmp, shards, writers)
+        context = multiprocessing.get_context('spawn')
+        ready = context.Semaphore(0)
+        go = context.Event()
+        deadline = context.Value('d', 0.0)
+        done = context.Value('i', 0)
+        errors = context.Value('i', 0)
+        processes = [
+            context.Process(target=writer, args=(tmp, shards, user_id, vehicle_id, lot_id, ready, go, deadline, done, errors))
+            for (user_id, vehicle_id), lot_id in zip(people, lot_ids)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.acquire()
+        deadline.value = time.time() + seconds
+        go.set()
+        for process in processes:
+            process.join()
+        used = len({shard_of(lot_id) for lot_id in lot_ids})
+    return done.value / seconds, errors.value, used
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    counts = [int(arg) for arg in sys.argv[3:]] or [1, 2, 4]
+    print(f'{writers} writer processes, {seconds:.0f}s each, on {os.cpu_count()} CPU(s)')
+    for shards in counts:
+        bookings, errors, used = run(shards, writers, seconds)
+        print(f'{shards} shard(s): {bookings:6.1f} book+release/s, {errors} failed, lots on {used} database(s)')
+        # The shared db object keeps a metadata per bind key it has seen.
+        for k in range(1, shards):
+            db.metadatas.pop(f'shard{k}', None)
+
+if __name__ == '__main__':
+    main()
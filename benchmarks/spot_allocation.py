@@ -0,0 +1,131 @@
+"""Spot allocation on a large multi-floor garage.
+
+Usage: python benchmarks/spot_allocation.py [spots] [floors] [events]
+Fills the garage to 85% and then runs a random arrival/departure stream,
+comparing the old book_lot policy (first free spot by id) with LotAllocator
+on time per pick, mean walking distance and the spread of floor fill. The
+allocator's scoring evaluated over every free spot (linear-scan) is timed
+on the final state for reference.
+"""
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.layout import SIZE_CLASSES, generate_layout, fits
+from models.allocator import LotAllocator
+
+VEHICLES = ['Car'] * 7 + ['Bike', 'SUV', 'Van']
+SIZES = {0: 'S', 1: 'S', 18: 'L', 19: 'L'}
+
+class LowestId:
+    def __init__(self, layout):
+        self.layout = layout
+        self.free = {size: [] for size in SIZE_CLASSES}
+        for spot_id, spot in layout.items():
+            self.free[spot['size_class']].append(spot_id)
+        for heap in self.free.values():
+            heapq.heapify(heap)
+
+    def pick(self, vehicle_type):
+        candidates = [heap[0] for size, heap in self.free.items() if heap and fits(vehicle_type, size)]
+        if not candidates:
+            return None
+        spot_id = min(candidates)
+        heapq.heappop(self.free[self.layout[spot_id]['size_class']])
+        return spot_id
+
+    def release(self, spot_id):
+        heapq.heappush(self.free[self.layout[spot_id]['size_class']], spot_id)
+
+class LinearScan:
+    def __init__(self, layout, floor_balance, parked):
+        self.layout = layout
+        self.floor_balance = floor_balance
+        self.free = set(layout) - set(parked)
+        self.total = {}
+        self.occupied = {}
+        for spot_id, spot in layout.items():
+            self.total[spot['floor']] = self.total.get(spot['floor'], 0) + 1
+            self.occupied.setdefault(spot['floor'], 0)
+            if spot_id not in self.free:
+                self.occupied[spot['floor']] += 1
+
+    def pick(self, vehicle_type):
+        # Smallest fitting size class first, then best score, like LotAllocator.
+        best = None
+        for spot_id in self.free:
+            spot = self.layout[spot_id]
+            if not fits(vehicle_type, spot['size_class']):
+                continue
+            floor = spot['floor']
+            key = (
+                SIZE_CLASSES.index(spot['size_class']),
+                spot['distance'] + self.floor_balance * self.occupied[floor] / self.total[floor]
+            )
+            if best is None or key < best[0]:
+                best = (key, spot_id)
+        if best is None:
+            return None
+        self.free.discard(best[1])
+        self.occupied[self.layout[best[1]]['floor']] += 1
+        return best[1]
+
+def simulate(name, allocator, layout, floors, events, seed=7):
+    rng = random.Random(seed)
+    parked = []
+    distances = []
+    capacity = len(layout)
+    start = time.perf_counter()
+    picks = 0
+    for step in range(int(capacity * 0.85) + events):
+        warming = step < capacity * 0.85
+        if warming or rng.random() < 0.5 or not parked:
+            spot_id = allocator.pick(rng.choice(VEHICLES))
+            picks += 1
+            if spot_id is not None:
+                parked.append(spot_id)
+                if not warming:
+                    distances.append(layout[spot_id]['distance'])
+        else:
+            index = rng.randrange(len(parked))
+            parked[index], parked[-1] = parked[-1], parked[index]
+            allocator.release(parked.pop())
+    elapsed = time.perf_counter() - start
+    fill = [0] * floors
+    for spot_id in parked:
+        fill[layout[spot_id]['floor']] += 1
+    report(name, elapsed / picks, distances, fill, capacity / floors)
+    return parked
+
+def report(name, per_pick, distances, fill, per_floor):
+    fractions = [count / per_floor for count in fill]
+    print(f'{name:>12}: {per_pick * 1e6:8.1f}us/pick, '
+          f'mean distance {sum(distances) / max(len(distances), 1):7.1f}m, '
+          f'floor fill {min(fractions):.0%}..{max(fractions):.0%}')
+
+def main():
+    spots = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    floors = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    events = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+    layout = {
+        spot_id: spot
+        for spot_id, spot in enumerate(generate_layout('G', spots, floors, row_length=20, sizes=SIZES), 1)
+    }
+    rows = [(spot_id, s['floor'], s['distance'], s['size_class'], 'A') for spot_id, s in layout.items()]
+    heap = LotAllocator(rows)
+    simulate('lowest-id', LowestId(layout), layout, floors, events)
+    parked = simulate('heap', heap, layout, floors, events)
+    scan = LinearScan(layout, heap.floor_balance, parked)
+    rng = random.Random(7)
+    samples = 200
+    start = time.perf_counter()
+    for _ in range(samples):
+        scan.pick(rng.choice(VEHICLES))
+    print(f'{"linear-scan":>12}: {(time.perf_counter() - start) / samples * 1e6:8.1f}us/pick')
+
+if __name__ == '__main__':
+    main()
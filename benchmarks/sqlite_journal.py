@@ -0,0 +1,124 @@
+"""Booking write throughput under report traffic: WAL vs rollback journal.
+
+Usage: python benchmarks/sqlite_journal.py [writers] [readers] [seconds]
+Writer processes book and release spots through the real endpoints while
+reader processes loop over the admin revenue summary, once with
+SQLITE_JOURNAL_MODE=WAL and once with the rollback journal (DELETE).
+"""
+import os
+import sys
+import tempfile
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models.models import db, create_admin, create_sample_data, User, Vehicle, Reservation, ParkingSpot
+
+HISTORY = 20000
+
+def make_app(path, journal_mode):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'SQLITE_JOURNAL_MODE': journal_mode,
+        'EVENT_LOG_DIR': None,
+        'SECRET_KEY': 'bench'
+    })
+
+def build(path, journal_mode, writers):
+    app = make_app(path, journal_mode)
+    with app.app_context():
+        db.create_all()
+        create_admin()
+        create_sample_data()
+        users = [User(username=f'writer{i}', email=f'writer{i}@test.com', password_hash='-') for i in range(writers)]
+        db.session.add_all(users)
+        db.session.flush()
+        vehicles = [Vehicle(user_id=user.id, vehicle_number=f'WRT{i:05d}', vehicle_type='Car') for i, user in enumerate(users)]
+        db.session.add_all(vehicles)
+        db.session.flush()
+        spot_ids = [spot_id for spot_id, in db.session.query(ParkingSpot.id)]
+        start = datetime(2025, 1, 1)
+        db.session.execute(db.insert(Reservation), [
+            {'spot_id': spot_ids[i % len(spot_ids)], 'user_id': users[0].id, 'vehicle_id': vehicles[0].id, 'parking_cost': 50.0,
+             'parking_timestamp': start + timedelta(hours=i), 'leaving_timestamp': start + timedelta(hours=i + 2)}
+            for i in range(HISTORY)
+        ])
+        db.session.commit()
+        people = [(user.id, vehicle.id) for user, vehicle in zip(users, vehicles)]
+        admin_id = User.query.filter_by(username='admin').first().id
+        db.engine.dispose()
+    return people, admin_id
+
+def client_for(app, user_id, is_admin=False):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+        sess['is_admin'] = is_admin
+    return client
+
+def writer(path, journal_mode, user_id, vehicle_id, ready, go, deadline, done, errors):
+    client = client_for(make_app(path, journal_mode), user_id)
+    ready.release()
+    go.wait()
+    while time.time() < deadline.value:
+        booked = client.post('/book_lot/2', json={'vehicle_id': vehicle_id})
+        if booked.status_code != 200:
+            with errors.get_lock():
+                errors.value += 1
+            continue
+        released = client.post(f"/release_spot/{booked.get_json()['reservation_id']}")
+        with done.get_lock():
+            done.value += 1
+            errors.value += released.status_code != 200
+
+def reader(path, journal_mode, admin_id, ready, go, deadline, served):
+    client = client_for(make_app(path, journal_mode), admin_id, is_admin=True)
+    ready.release()
+    go.wait()
+    while time.time() < deadline.value:
+        client.get('/admin/summary')
+        with served.get_lock():
+            served.value += 1
+
+def run(journal_mode, writers, readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        people, admin_id = build(path, journal_mode, writers)
+        context = multiprocessing.get_context('spawn')
+        ready = context.Semaphore(0)
+        go = context.Event()
+        deadline = context.Value('d', 0.0)
+        done = context.Value('i', 0)
+        errors = context.Value('i', 0)
+        served = context.Value('i', 0)
+        processes = [
+            context.Process(target=writer, args=(path, journal_mode, user_id, vehicle_id, ready, go, deadline, done, errors))
+            for user_id, vehicle_id in people
+        ] + [
+            context.Process(target=reader, args=(path, journal_mode, admin_id, ready, go, deadline, served))
+            for _ in range(readers)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.acquire()
+        deadline.value = time.time() + seconds
+        go.set()
+        for process in processes:
+            process.join()
+    return done.value / seconds, errors.value, served.value / seconds
+
+def main():
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    print(f'{writers} writer and {readers} reader processes, {seconds:.0f}s each')
+    for journal_mode in ('DELETE', 'WAL'):
+        bookings, errors, reports = run(journal_mode, writers, readers, seconds)
+        print(f'{journal_mode:>7}: {bookings:6.1f} book+release/s, {errors} failed, {reports:5.1f} summaries/s')
+
+if __name__ == '__main__':
+    main()
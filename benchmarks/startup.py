@@ -0,0 +1,85 @@
+"""Worker startup cost: import time, app construction and first request.
+
+Usage: python benchmarks/startup.py [runs] [logged_events]
+Each run is a fresh interpreter, so module import caches do not carry over.
+The app is built against a file database with the event log turned on and
+already holding logged_events events, as a long-running deployment that
+enables it would have. The first request is a signed-in user's dashboard,
+so it pays for the controllers, the templates and the first database
+connection. Single runs swing with machine load; compare medians.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+KEYS = ('import', 'create_app', 'first_request', 'total')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + sys.argv[1], 'EVENT_LOG_DIR': sys.argv[2]})
+created = time.perf_counter()
+client = app.test_client()
+with client.session_transaction() as sess:
+    sess['user_id'] = 1
+assert client.get('/dashboard').status_code == 200
+served = time.perf_counter()
+print(json.dumps({
+    'import': imported - start,
+    'create_app': created - imported,
+    'first_request': served - created,
+    'total': served - start
+}))
+'''
+
+def prepare(tmp, logged_events):
+    from app import create_app
+    from models.event_log import WRITER_PREFIX, SEGMENT_PREFIX, CHECKPOINT_FILE, _encode
+    from models.models import db, create_admin, create_sample_data
+    path = os.path.join(tmp, 'park.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'EVENT_LOG_DIR': None})
+    with app.app_context():
+        db.create_all()
+        create_admin()
+        create_sample_data()
+        db.engine.dispose()
+    root = os.path.join(tmp, 'event_log')
+    writer = os.path.join(root, f'{WRITER_PREFIX}001')
+    os.makedirs(writer)
+    with open(os.path.join(writer, f'{SEGMENT_PREFIX}000001.log'), 'wb') as f:
+        for seq in range(1, logged_events + 1):
+            f.write(_encode({'type': 'book', 'reservation_id': seq, 'spot_id': 1, 'user_id': 2, 'vehicle_id': 1,
+                'parking_timestamp': '2025-11-10T10:00:00', 'leaving_timestamp': None, 'parking_cost': 50.0, 'seq': seq}))
+    with open(os.path.join(writer, CHECKPOINT_FILE), 'w') as f:
+        f.write(str(logged_events))
+    return path, root
+
+def sample_runs(runs, logged_events):
+    with tempfile.TemporaryDirectory() as tmp:
+        path, root = prepare(tmp, logged_events)
+        samples = []
+        for _ in range(runs):
+            result = subprocess.run([sys.executable, '-c', PROBE, path, root], cwd=ROOT, capture_output=True, text=True, check=True)
+            samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return samples
+
+def measure(runs=5, logged_events=50000):
+    samples = sample_runs(runs, logged_events)
+    return {key: sorted(sample[key] for sample in samples)[len(samples) // 2] for key in KEYS}
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    logged_events = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    samples = sample_runs(runs, logged_events)
+    for key in KEYS:
+        values = sorted(sample[key] * 1000 for sample in samples)
+        print(f'{key:>14}: median {values[len(values) // 2]:.1f}ms, max {values[-1]:.1f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Per-row cost of timestamp formatting on a history-sized page.
+
+Usage: python benchmarks/time_format.py [rows]
+Compares the original to_ist_str (timezone lookup + astimezone per call)
+with the cached-offset path and the batch formatter.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pytz import timezone, utc
+from models.timefmt import format_local, format_many
+
+def original_to_ist_str(dt, fmt='%Y-%m-%d %H:%M'):
+    if not dt:
+        return ''
+    ist = timezone('Asia/Kolkata')
+    if dt.tzinfo is None:
+        dt = utc.localize(dt)
+    return dt.astimezone(ist).strftime(fmt)
+
+def timed(label, rows, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>22}: {elapsed * 1000:7.1f}ms total, {elapsed / rows * 1e6:5.2f}us/row')
+    return result
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    stamps = [base + timedelta(minutes=37 * i) for i in range(rows)]
+    expected = timed('original to_ist_str', rows, lambda: [original_to_ist_str(dt) for dt in stamps])
+    cached = timed('format_local per row', rows, lambda: [format_local(dt) for dt in stamps])
+    batch = timed('format_many', rows, lambda: format_many(stamps))
+    assert expected == cached == batch
+
+if __name__ == '__main__':
+    main()
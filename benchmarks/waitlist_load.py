@@ -0,0 +1,169 @@
+"""Request volume at a full lot: client retry loop vs waitlist long-poll.
+
+Usage: python benchmarks/waitlist_load.py [clients] [release_interval_seconds] [waiters]
+A full 'Central Mall' lot frees one car-sized spot every release_interval
+(it has 18, so at most 18 clients); each client wants one spot. Retry clients call /book_lot every 100ms until they get one;
+waitlist clients join once and long-poll their entry.
+
+The second part runs every request on one 60-thread pool, like a threaded
+server with 60 workers, while waiters long-poll the full lot and one user books and releases
+in another lot: once with the default WAITLIST_MAX_WAITERS and once with
+no cap.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from models.models import db, create_sample_data, User, Vehicle, ParkingSpot, Reservation
+from models.layout import fits
+
+RETRY_INTERVAL = 0.1
+EXECUTOR_THREADS = 60
+
+def build(path, clients, config=None):
+    app = create_app(dict({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'EVENT_LOG_DIR': None,
+        'SECRET_KEY': 'bench'
+    }, **(config or {})))
+    with app.app_context():
+        db.create_all()
+        create_sample_data()
+        parker = User(username='parker', email='parker@test.com', password_hash='-')
+        db.session.add(parker)
+        db.session.flush()
+        db.session.add(Vehicle(user_id=parker.id, vehicle_number='PARKER01'))
+        for i in range(clients):
+            user = User(username=f'client{i}', email=f'client{i}@test.com', password_hash='-')
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(Vehicle(user_id=user.id, vehicle_number=f'CLIENT{i:04d}'))
+        db.session.flush()
+        reservations = []
+        for spot in ParkingSpot.query.filter_by(lot_id=1).all():
+            spot.status = 'O'
+            reservations.append(Reservation(spot_id=spot.id, user_id=parker.id, vehicle_id=1, parking_cost=50.0))
+        db.session.add_all(reservations)
+        db.session.commit()
+        # Client vehicles have no type (car-sized): releasing a bike bay would
+        # not serve any of them.
+        ids = [r.id for r in reservations if fits(None, r.spot.size_class)]
+        parker_id = parker.id
+        client_users = [(u.id, v.id) for u, v in db.session.query(User, Vehicle).join(Vehicle).filter(User.username != 'parker')]
+    # Load the controllers now rather than in the clients' first requests,
+    # which would otherwise still be joining when the first spot frees up.
+    app.test_client().get('/')
+    return app, parker_id, ids, client_users
+
+def client_for(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    return client
+
+def run(mode, clients, release_interval):
+    with tempfile.TemporaryDirectory() as tmp:
+        app, parker_id, reservation_ids, users = build(os.path.join(tmp, 'bench.db'), clients)
+        if clients > len(reservation_ids):
+            raise ValueError(f'at most {len(reservation_ids)} clients')
+        counts = {'requests': 0, 'served': 0}
+        lock = threading.Lock()
+
+        def count(served=False):
+            with lock:
+                counts['requests'] += 1
+                counts['served'] += served
+
+        def retry_client(user_id, vehicle_id):
+            client = client_for(app, user_id)
+            while True:
+                response = client.post('/book_lot/1', json={'vehicle_id': vehicle_id})
+                count(response.status_code == 200)
+                if response.status_code == 200:
+                    return
+                time.sleep(RETRY_INTERVAL)
+
+        def waitlist_client(user_id, vehicle_id):
+            client = client_for(app, user_id)
+            entry = client.post('/waitlist/1', json={'vehicle_id': vehicle_id}).get_json()
+            count()
+            while True:
+                status = client.get(f"/waitlist/entry/{entry['entry_id']}?wait=25").get_json()
+                count(status['status'] == 'assigned')
+                if status['status'] != 'waiting':
+                    return
+                time.sleep(status.get('retry_after', 0))
+
+        target = retry_client if mode == 'retry' else waitlist_client
+        threads = [threading.Thread(target=target, args=user) for user in users]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        releaser = client_for(app, parker_id)
+        for reservation_id in reservation_ids[:clients]:
+            time.sleep(release_interval)
+            releaser.post(f'/release_spot/{reservation_id}')
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            db.engine.dispose()
+    return counts, elapsed
+
+def run_shared_executor(max_waiters, waiters, seconds=10):
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {'WAITLIST_MAX_WAITERS': max_waiters} if max_waiters else {}
+        app, _, _, users = build(os.path.join(tmp, 'bench.db'), waiters + 1, config)
+        (booker_id, booker_vehicle), users = users[0], users[1:]
+        executor = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS)
+        stop = threading.Event()
+
+        def waiter(user_id, vehicle_id):
+            client = client_for(app, user_id)
+            entry = executor.submit(client.post, '/waitlist/1', json={'vehicle_id': vehicle_id}).result().get_json()
+            while not stop.is_set():
+                status = executor.submit(client.get, f"/waitlist/entry/{entry['entry_id']}?wait=5").result().get_json()
+                stop.wait(status.get('retry_after', 0))
+
+        threads = [threading.Thread(target=waiter, args=user) for user in users]
+        for t in threads:
+            t.start()
+        time.sleep(1)
+        client = client_for(app, booker_id)
+        latencies = []
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            booked = executor.submit(client.post, '/book_lot/2', json={'vehicle_id': booker_vehicle}).result()
+            executor.submit(client.post, f"/release_spot/{booked.get_json()['reservation_id']}").result()
+            latencies.append(time.perf_counter() - start)
+        stop.set()
+        for t in threads:
+            t.join()
+        executor.shutdown()
+        with app.app_context():
+            db.engine.dispose()
+    latencies.sort()
+    return len(latencies), latencies[len(latencies) // 2], latencies[-1]
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 18
+    release_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    waiters = int(sys.argv[3]) if len(sys.argv) > 3 else 80
+    for mode in ('retry', 'waitlist'):
+        counts, elapsed = run(mode, clients, release_interval)
+        print(f'{mode:>8}: {counts["served"]}/{clients} served in {elapsed:.1f}s, '
+              f'{counts["requests"]} client requests ({counts["requests"] / clients:.1f} per client)')
+    print(f'{waiters} waiters and one booker on a {EXECUTOR_THREADS}-thread executor')
+    for label, max_waiters in (('default cap', None), ('no cap', waiters)):
+        bookings, median, worst = run_shared_executor(max_waiters, waiters)
+        print(f'{label:>11}: {bookings} book+release, median {median * 1000:.0f}ms, max {worst * 1000:.0f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,53 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, make_response, current_app
 from models.models import db, User, ParkingLot, ParkingSpot, Reservation, Vehicle, to_ist_str
+from models.vehicle_registry import get_registry
+from models.stats import get_stats
+from models.layout import ROW_SIZES, ROW_LENGTH, SIZE_CLASSES, DEFAULT_SIZE, generate_layout
+from models.replicas import get_monitor, replica_keys
+from models.shards import fan_out, fan_out_rows
+from controllers.read_only import read_only
 from datetime import datetime
-import io, csv
+from sqlalchemy.orm import selectinload
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+# Cap on plate matches fed into the vehicle listing's IN clause.
+PLATE_SEARCH_LIMIT = 500
 
 @admin_bp.route('/dashboard')
 def dashboard():
     if not session.get('is_admin'):
         return redirect(url_for('user.login'))
-    lots = ParkingLot.query.all()
-    total_spots = ParkingSpot.query.count()
-    occupied_spots = ParkingSpot.query.filter_by(status='O').count()
-    available_spots = total_spots - occupied_spots
-    total_users = User.query.filter_by(is_admin=False).count()
+    totals = get_stats().totals()
     search = request.args.get('search', '')
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     availability = request.args.get('availability', '')
-    query = ParkingLot.query
-    if search:
-        query = query.filter(
-            (ParkingLot.prime_location_name.contains(search)) |
-            (ParkingLot.address.contains(search)) |
-            (ParkingLot.pin_code.contains(search))
-        )
-    if min_price:
-        query = query.filter(ParkingLot.price_per_hour >= min_price)
-    if max_price:
-        query = query.filter(ParkingLot.price_per_hour <= max_price)
-    lots = query.all()
+
+    def shard_lots():
+        query = ParkingLot.query.options(selectinload(ParkingLot.spots))
+        if search:
+            query = query.filter(
+                (ParkingLot.prime_location_name.contains(search)) |
+                (ParkingLot.address.contains(search)) |
+                (ParkingLot.pin_code.contains(search))
+            )
+        if min_price:
+            query = query.filter(ParkingLot.price_per_hour >= min_price)
+        if max_price:
+            query = query.filter(ParkingLot.price_per_hour <= max_price)
+        return query.all()
+
+    lots = fan_out_rows(db, shard_lots)
     if availability == 'available':
         lots = [lot for lot in lots if any(spot.status == 'A' for spot in lot.spots)]
     elif availability == 'full':
         lots = [lot for lot in lots if all(spot.status == 'O' for spot in lot.spots)]
     return render_template('admin_dashboard.html',
         lots=lots,
-        total_spots=total_spots,
-        occupied_spots=occupied_spots,
-        available_spots=available_spots,
-        total_users=total_users,
+        total_spots=totals['total_spots'],
+        occupied_spots=totals['occupied_spots'],
+        available_spots=totals['available_spots'],
+        total_users=totals['total_users'],
         filters={
             'search': search,
             'min_price': min_price,
@@ -48,6 +56,7 @@ def dashboard():
         })
 
 @admin_bp.route('/users')
+@read_only
 def users():
     if not session.get('is_admin'):
         return redirect(url_for('user.login'))
@@ -65,6 +74,7 @@ def users():
     return render_template('admin_users.html', users=users, search=search)
 
 @admin_bp.route('/vehicles')
+@read_only
 def vehicles():
     if not session.get('is_admin'):
         return redirect(url_for('user.login'))
@@ -73,8 +83,9 @@ def vehicles():
     per_page = 10
     query = Vehicle.query.join(User).filter(User.is_admin == False)
     if search:
+        plate_matches = get_registry().search(search, limit=PLATE_SEARCH_LIMIT)
         query = query.filter(
-            (Vehicle.vehicle_number.contains(search)) |
+            (Vehicle.id.in_(plate_matches)) |
             (Vehicle.vehicle_type.contains(search)) |
             (User.username.contains(search))
         )
@@ -82,9 +93,37 @@ def vehicles():
     return render_template('admin_vehicles.html', vehicles=vehicles, search=search)
 
 @admin_bp.route('/summary')
+@read_only
 def summary():
     if not session.get('is_admin'):
         return redirect(url_for('user.login'))
+    shards = fan_out(db, _shard_summary)
+    lots = [lot for shard_lots, _, _, _ in shards for lot in shard_lots]
+    total_revenue = sum(revenue for _, revenue, _, _ in shards)
+    # A month's revenue can come from several shards; each lot's from one.
+    by_month = {}
+    for _, _, months, _ in shards:
+        for month, revenue in months:
+            by_month[month] = by_month.get(month, 0) + (revenue or 0)
+    monthly_revenue = [{'month': month, 'revenue': by_month[month]} for month in sorted(by_month)]
+    lot_performance = [row for _, _, _, rows in shards for row in rows]
+    stats = get_stats()
+    lot_data = []
+    for lot in lots:
+        counts = stats.lot(lot.id)
+        lot_data.append({
+            'name': lot.prime_location_name,
+            'occupied_spots': counts['occupied_spots'],
+            'total_spots': counts['total_spots']
+        })
+    return render_template('admin_summary.html',
+        lots=lots,
+        total_revenue=total_revenue,
+        monthly_revenue=monthly_revenue,
+        lot_performance=lot_performance,
+        lot_data=lot_data)
+
+def _shard_summary():
     lots = ParkingLot.query.all()
     total_revenue = db.session.query(db.func.sum(Reservation.parking_cost)).filter(
         Reservation.leaving_timestamp != None
@@ -108,51 +147,52 @@ def summary():
     ).filter(
         Reservation.leaving_timestamp != None
     ).group_by(ParkingLot.id).all()
-    lot_data = []
-    for lot in lots:
-        occupied_spots = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
-        total_spots = ParkingSpot.query.filter_by(lot_id=lot.id).count()
-        lot_data.append({
-            'name': lot.prime_location_name,
-            'occupied_spots': occupied_spots,
-            'total_spots': total_spots
-        })
-    return render_template('admin_summary.html',
-        lots=lots,
-        total_revenue=total_revenue,
-        monthly_revenue=monthly_revenue,
-        lot_performance=lot_performance,
-        lot_data=lot_data)
+    return lots, total_revenue, [tuple(row) for row in monthly_revenue], lot_performance
+
+@admin_bp.route('/reports', methods=['GET', 'POST'])
+def reports():
+    if not session.get('is_admin'):
+        return redirect(url_for('user.login'))
+    from models.reports import export_snapshot, build_report, DAYS
+    report_dir = current_app.config.get('REPORT_DIR', 'reports')
+    if request.method == 'POST':
+        exported = export_snapshot(report_dir)
+        flash(f'Exported {exported} new reservations', 'success')
+        return redirect(url_for('admin.reports'))
+    report = build_report(report_dir)
+    return render_template('admin_reports.html', report=report, days=DAYS)
 
 @admin_bp.route('/export_summary')
+@read_only
 def export_summary():
     if not session.get('is_admin'):
         return redirect(url_for('user.login'))
+    import io, csv
     output = io.StringIO()
     writer = csv.writer(output)
     writer.writerow(['Parko - Statistical Summary'])
     writer.writerow(['Generated on:', datetime.now().strftime('%Y-%m-%d %H:%M:%S')])
     writer.writerow([])
+    stats = get_stats()
+    totals = stats.totals()
     writer.writerow(['Overall Statistics'])
-    writer.writerow(['Total Parking Lots', ParkingLot.query.count()])
-    writer.writerow(['Total Parking Spots', ParkingSpot.query.count()])
-    writer.writerow(['Total Users', User.query.filter_by(is_admin=False).count()])
-    writer.writerow(['Total Reservations', Reservation.query.count()])
+    writer.writerow(['Total Parking Lots', totals['total_lots']])
+    writer.writerow(['Total Parking Spots', totals['total_spots']])
+    writer.writerow(['Total Users', totals['total_users']])
+    writer.writerow(['Total Reservations', totals['total_reservations']])
     writer.writerow([])
     writer.writerow(['Lot-wise Statistics'])
     writer.writerow(['Location Name', 'Address', 'Pin Code', 'Price/Hour', 'Total Spots', 'Occupied Spots', 'Available Spots'])
-    for lot in ParkingLot.query.all():
-        total_spots = ParkingSpot.query.filter_by(lot_id=lot.id).count()
-        occupied_spots = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
-        available_spots = total_spots - occupied_spots
+    for lot in fan_out_rows(db, lambda: ParkingLot.query.all()):
+        counts = stats.lot(lot.id)
         writer.writerow([
             lot.prime_location_name,
             lot.address,
             lot.pin_code,
             lot.price_per_hour,
-            total_spots,
-            occupied_spots,
-            available_spots
+            counts['total_spots'],
+            counts['occupied_spots'],
+            counts['available_spots']
         ])
     output.seek(0)
     response = make_response(output.getvalue())
@@ -170,6 +210,11 @@ def create_lot():
         pin_code = request.form['pin_code']
         price = float(request.form['price'])
         spots = int(request.form['spots'])
+        floors = request.form.get('floors', 1, type=int) or 1
+        row_sizes = parse_row_sizes(request.form.get('row_sizes', ''))
+        if row_sizes is None:
+            flash('Spot sizes must be S, M, L or XL', 'error')
+            return render_template('create_lot.html', row_sizes=request.form.get('row_sizes', ''))
         lot = ParkingLot(
             prime_location_name=name,
             address=address,
@@ -177,19 +222,28 @@ def create_lot():
             price_per_hour=price,
             maximum_number_of_spots=spots
         )
+        # New lots go to the shard holding the fewest.
+        lot_counts = fan_out(db, lambda: ParkingLot.query.count())
+        db.session.info['shard'] = lot_counts.index(min(lot_counts))
         db.session.add(lot)
         db.session.commit()
-        for i in range(1, spots + 1):
-            spot = ParkingSpot(
-                lot_id=lot.id,
-                spot_number=f'{name[:1]}{i:02d}',
-                status='A'
-            )
-            db.session.add(spot)
+        for layout in generate_layout(name[:1], spots, floors, sizes=row_sizes or ROW_SIZES):
+            db.session.add(ParkingSpot(lot_id=lot.id, status='A', **layout))
         db.session.commit()
         flash('Parking lot created successfully!', 'success')
         return redirect(url_for('admin.dashboard'))
-    return render_template('create_lot.html')
+    return render_template('create_lot.html', row_sizes=format_row_sizes(ROW_SIZES))
+
+def parse_row_sizes(text):
+    # One size class per position in a row of ten, e.g. "S M M M M M M M L XL".
+    # Returns {position: size}, empty for blank input, or None if invalid.
+    row_sizes = text.upper().split()
+    if any(size not in SIZE_CLASSES for size in row_sizes):
+        return None
+    return dict(enumerate(row_sizes))
+
+def format_row_sizes(sizes):
+    return ' '.join(sizes.get(i, DEFAULT_SIZE) for i in range(ROW_LENGTH))
 
 @admin_bp.route('/edit_lot/<int:lot_id>', methods=['GET', 'POST'])
 def edit_lot(lot_id):
@@ -202,25 +256,84 @@ def edit_lot(lot_id):
         lot.pin_code = request.form['pin_code']
         lot.price_per_hour = float(request.form['price'])
         new_spots = int(request.form.get('new_spots', 0))
+        # Blank keeps the current sizes; a pattern re-sizes every spot.
+        resize = parse_row_sizes(request.form.get('row_sizes', ''))
+        if resize is None:
+            flash('Spot sizes must be S, M, L or XL', 'error')
+            return render_template('edit_lot.html', lot=lot, row_sizes=format_row_sizes(ROW_SIZES))
         # Remove selected spots
         spots_to_remove = request.form.getlist('spots_to_remove')
         for spot_id in spots_to_remove:
             spot = ParkingSpot.query.get(int(spot_id))
             if spot and spot.status == 'A':
                 db.session.delete(spot)
-        # Add new spots
+        sizes = resize or ROW_SIZES
+        if resize:
+            # Sizes follow each spot's position in its floor's rows, as for a new lot.
+            position = {}
+            for spot in ParkingSpot.query.filter_by(lot_id=lot.id).order_by(
+                    ParkingSpot.floor, ParkingSpot.distance, ParkingSpot.id):
+                column = position.get(spot.floor, 0)
+                position[spot.floor] = column + 1
+                spot.size_class = sizes.get(column % ROW_LENGTH, DEFAULT_SIZE)
+        # Add new spots at the far end of the top floor
+        last = ParkingSpot.query.filter_by(lot_id=lot.id).order_by(
+            ParkingSpot.floor.desc(), ParkingSpot.distance.desc()
+        ).first()
+        on_floor = ParkingSpot.query.filter_by(lot_id=lot.id, floor=last.floor).count() if last else 0
         for i in range(lot.maximum_number_of_spots + 1, lot.maximum_number_of_spots + new_spots + 1):
             spot = ParkingSpot(
                 lot_id=lot.id,
                 spot_number=f'{lot.prime_location_name[:1]}{i:02d}',
-                status='A'
+                status='A',
+                floor=last.floor if last else 0,
+                zone=last.zone if last else 'A',
+                distance=(last.distance if last else 0.0) + 2.5 * (i - lot.maximum_number_of_spots),
+                size_class=sizes.get((on_floor + i - lot.maximum_number_of_spots - 1) % ROW_LENGTH, DEFAULT_SIZE)
             )
             db.session.add(spot)
         lot.maximum_number_of_spots += new_spots
         db.session.commit()
         flash('Parking lot updated successfully!', 'success')
         return redirect(url_for('admin.dashboard'))
-    return render_template('edit_lot.html', lot=lot)
+    return render_template('edit_lot.html', lot=lot, row_sizes=format_row_sizes(ROW_SIZES))
+
+@admin_bp.route('/waitlist/<int:lot_id>')
+def waitlist(lot_id):
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    from models.waitlist import waiting_entries
+    lot = ParkingLot.query.get_or_404(lot_id)
+    entries = waiting_entries(lot_id)
+    return jsonify({
+        'lot_id': lot.id,
+        'lot_name': lot.prime_location_name,
+        'waiting': [
+            {
+                'entry_id': entry.id,
+                'position': position,
+                'user_id': entry.user_id,
+                'vehicle_id': entry.vehicle_id,
+                'priority': entry.priority,
+                'joined_at': to_ist_str(entry.created_at)
+            }
+            for position, entry in enumerate(entries, start=1)
+        ]
+    })
+
+@admin_bp.route('/replicas')
+def replicas():
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 403
+    monitor = get_monitor()
+    lags = monitor.check(db) if replica_keys(db) else {}
+    return jsonify({
+        'max_lag': monitor.max_lag,
+        'replicas': [
+            {'bind': key, 'lag_seconds': lag, 'healthy': lag is not None and lag <= monitor.max_lag}
+            for key, lag in sorted(lags.items())
+        ]
+    })
 
 @admin_bp.route('/delete_lot/<int:lot_id>', methods=['POST'])
 def delete_lot(lot_id):
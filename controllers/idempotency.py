@@ -0,0 +1,94 @@
+import hashlib
+from datetime import timedelta
+from functools import wraps
+from flask import request, session, jsonify, make_response, current_app
+from sqlalchemy.exc import IntegrityError
+from models.models import db, IdempotencyKey
+from models.clock import utcnow
+
+DEFAULT_TTL = timedelta(hours=24)
+
+def _fingerprint():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+def _evict_expired(now, ttl):
+    # Expired keys are cleared at most once per interval per process and
+    # shard, inside the transaction of the request that triggers it.
+    interval = current_app.config.get('IDEMPOTENCY_EVICT_INTERVAL', 300)
+    evicted_at = current_app.extensions.setdefault('idempotency_evicted_at', {})
+    shard = db.session.info.get('shard', 0)
+    last = evicted_at.get(shard)
+    if last is not None and (now - last).total_seconds() < interval:
+        return
+    evicted_at[shard] = now
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < now - ttl).delete()
+
+def _replay(record, fingerprint):
+    if record.fingerprint != fingerprint:
+        return jsonify({'success': False, 'error': 'Idempotency key reused with a different request'}), 422
+    response = make_response(record.response_body, record.status_code)
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(view):
+    # Requests carrying an Idempotency-Key header are run once per user and
+    # key; retries get the stored response back without re-running the view.
+    # The view's commits are deferred so that its writes and the stored
+    # response commit together: a crash leaves either both or neither, and
+    # of two duplicates running in parallel the second fails on the key and
+    # is rolled back.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        user_id = session.get('user_id')
+        if not key or not user_id:
+            return view(*args, **kwargs)
+        if len(key) > 64:
+            return jsonify({'success': False, 'error': 'Idempotency key too long'}), 400
+        fingerprint = _fingerprint()
+        now = utcnow()
+        ttl = current_app.config.get('IDEMPOTENCY_TTL', DEFAULT_TTL)
+        record = db.session.get(IdempotencyKey, (user_id, key))
+        if record is not None:
+            if record.created_at >= now - ttl:
+                return _replay(record, fingerprint)
+            # Only an expired row is removed: a parallel duplicate that
+            # already stored a fresh response keeps it and wins below.
+            IdempotencyKey.query.filter(
+                IdempotencyKey.user_id == user_id,
+                IdempotencyKey.key == key,
+                IdempotencyKey.created_at < now - ttl
+            ).delete()
+        db.session.info['defer_commit'] = True
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            db.session.info.pop('defer_commit', None)
+            db.session.rollback()
+            raise
+        db.session.info.pop('defer_commit', None)
+        if response.status_code < 500:
+            db.session.add(IdempotencyKey(
+                user_id=user_id,
+                key=key,
+                fingerprint=fingerprint,
+                status_code=response.status_code,
+                response_body=response.get_data(as_text=True),
+                created_at=now
+            ))
+        _evict_expired(now, ttl)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            record = db.session.get(IdempotencyKey, (user_id, key))
+            if record is None:
+                raise
+            return _replay(record, fingerprint)
+        return response
+    return wrapper
@@ -1,10 +1,21 @@
 from flask import Blueprint, render_template, request, session, jsonify
-from models.models import db, ParkingLot, ParkingSpot, Reservation, User, Vehicle, to_ist_str
-from datetime import datetime
+from models.models import db, ParkingLot, ParkingSpot, Reservation, User, Vehicle, WaitlistEntry, to_ist_str
+from models.vehicle_registry import get_registry
+from models.event_log import commit_logged
+from models.allocator import allocate_spot, get_allocator
+from models.layout import DEFAULT_SIZE
+from models import waitlist
+from controllers.idempotency import idempotent
+from controllers.read_only import read_only
+from models.clock import utcnow
 
 parking_bp = Blueprint('parking', __name__)
 
+# Seconds a status poll turned away from long-polling should wait before polling again.
+WAITLIST_RETRY_AFTER = 5
+
 @parking_bp.route('/lot/<int:lot_id>')
+@read_only
 def view_lot(lot_id):
     if not session.get('user_id'):
         return render_template('login.html')
@@ -16,7 +27,7 @@ def view_lot(lot_id):
         spots = [spot for spot in spots if search.lower() in spot.spot_number.lower()]
     if status in ['A', 'O']:
         spots = [spot for spot in spots if spot.status == status]
-    user_vehicles = Vehicle.query.filter_by(user_id=session['user_id']).all()
+    user_vehicles = get_registry().user_vehicles(session['user_id'])
     return render_template('view_lot.html', lot=lot, spots=spots, spot_filters={'search': search, 'status': status}, user_vehicles=user_vehicles)
 
 @parking_bp.route('/api/spot/<int:spot_id>')
@@ -55,6 +66,12 @@ def get_spot_details(spot_id):
         } if current_reservation else None
     })
 
+@parking_bp.route('/api/lot/<int:lot_id>/forecast')
+def get_lot_forecast(lot_id):
+    from models.forecast import lot_forecast
+    lot = ParkingLot.query.get_or_404(lot_id)
+    return jsonify(lot_forecast(lot))
+
 @parking_bp.route('/api/reservation-details/<int:spot_id>')
 def get_reservation_details(spot_id):
     if not session.get('is_admin'):
@@ -67,7 +84,7 @@ def get_reservation_details(spot_id):
     if not reservation:
         return jsonify({'error': 'No active reservation'}), 404
     parking_time = reservation.parking_timestamp
-    current_time = datetime.utcnow()
+    current_time = utcnow()
     elapsed_seconds = (current_time - parking_time).total_seconds()
     elapsed_hours = elapsed_seconds / 3600
     current_cost = round(elapsed_hours * spot.lot.price_per_hour, 2)
@@ -92,6 +109,7 @@ def get_reservation_details(spot_id):
     })
 
 @parking_bp.route('/book_spot/<int:spot_id>', methods=['POST'])
+@idempotent
 def book_spot(spot_id):
     if not session.get('user_id') or session.get('is_admin'):
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
@@ -101,9 +119,12 @@ def book_spot(spot_id):
     vehicle_id = request.json.get('vehicle_id')
     if not vehicle_id:
         return jsonify({'success': False, 'error': 'Vehicle selection required'}), 400
-    vehicle = Vehicle.query.get(vehicle_id)
-    if not vehicle or vehicle.user_id != session['user_id']:
+    registry = get_registry()
+    if not registry.owned_by(vehicle_id, session['user_id']):
         return jsonify({'success': False, 'error': 'Invalid vehicle'}), 400
+    vehicle_type = registry.get(int(vehicle_id)).vehicle_type
+    if (spot.size_class or DEFAULT_SIZE) not in get_allocator().sizes_for(spot.lot_id, vehicle_type):
+        return jsonify({'success': False, 'error': 'Spot is too small for this vehicle'}), 400
     reservation = Reservation(
         spot_id=spot_id,
         user_id=session['user_id'],
@@ -112,7 +133,7 @@ def book_spot(spot_id):
     )
     spot.status = 'O'
     db.session.add(reservation)
-    db.session.commit()
+    commit_logged('book', reservation)
     return jsonify({
         'success': True,
         'message': 'Spot booked successfully!',
@@ -120,19 +141,30 @@ def book_spot(spot_id):
     })
 
 @parking_bp.route('/book_lot/<int:lot_id>', methods=['POST'])
+@idempotent
 def book_lot(lot_id):
     if not session.get('user_id') or session.get('is_admin'):
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     lot = ParkingLot.query.get_or_404(lot_id)
-    spot = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').order_by(ParkingSpot.id).first()
-    if not spot:
-        return jsonify({'success': False, 'error': 'No available spots'}), 400
     vehicle_id = request.json.get('vehicle_id')
     if not vehicle_id:
         return jsonify({'success': False, 'error': 'Vehicle selection required'}), 400
-    vehicle = Vehicle.query.get(vehicle_id)
-    if not vehicle or vehicle.user_id != session['user_id']:
+    registry = get_registry()
+    if not registry.owned_by(vehicle_id, session['user_id']):
         return jsonify({'success': False, 'error': 'Invalid vehicle'}), 400
+    vehicle_type = registry.get(int(vehicle_id)).vehicle_type
+    spot = allocate_spot(lot_id, vehicle_type)
+    # Spots that free up outside release_spot (e.g. new spots added by an
+    # admin) go to people already queued before any new request.
+    while spot:
+        handed_over = waitlist.assign_next(spot)
+        if not handed_over:
+            break
+        commit_logged('book', handed_over)
+        waitlist.notify_assigned()
+        spot = allocate_spot(lot_id, vehicle_type)
+    if not spot:
+        return jsonify({'success': False, 'error': 'No available spots', 'waitlist': True}), 400
     reservation = Reservation(
         spot_id=spot.id,
         user_id=session['user_id'],
@@ -141,30 +173,91 @@ def book_lot(lot_id):
     )
     spot.status = 'O'
     db.session.add(reservation)
-    db.session.commit()
+    commit_logged('book', reservation)
     return jsonify({
         'success': True,
         'message': f'Spot {spot.spot_number} booked successfully!',
         'reservation_id': reservation.id,
-        'spot_number': spot.spot_number
+        'spot_number': spot.spot_number,
+        'floor': spot.floor,
+        'zone': spot.zone
     })
 
 @parking_bp.route('/release_spot/<int:reservation_id>', methods=['POST'])
+@idempotent
 def release_spot(reservation_id):
     if not session.get('user_id') or session.get('is_admin'):
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     reservation = Reservation.query.get_or_404(reservation_id)
     if reservation.leaving_timestamp is not None:
         return jsonify({'success': False, 'error': 'Spot already released'}), 400
-    reservation.leaving_timestamp = datetime.utcnow()
+    spot = ParkingSpot.query.get(reservation.spot_id)
+    reservation.leaving_timestamp = utcnow()
     duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
     total_cost = round(duration * reservation.parking_cost, 2)
     reservation.parking_cost = total_cost
-    spot = ParkingSpot.query.get(reservation.spot_id)
     spot.status = 'A'
-    db.session.commit()
+    # Without a waiter nothing is flushed before commit_logged appends.
+    with db.session.no_autoflush:
+        handed_over = waitlist.assign_next(spot)
+    commit_logged('release', reservation, [('book', handed_over)] if handed_over else ())
+    if handed_over:
+        waitlist.notify_assigned()
     return jsonify({
         'success': True,
         'message': f'Spot released successfully! Total cost: Rs. {total_cost}',
         'total_cost': total_cost
-    })
\ No newline at end of file
+    })
+
+@parking_bp.route('/waitlist/<int:lot_id>', methods=['POST'])
+@idempotent
+def join_waitlist(lot_id):
+    if not session.get('user_id') or session.get('is_admin'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    ParkingLot.query.get_or_404(lot_id)
+    vehicle_id = request.json.get('vehicle_id')
+    if not vehicle_id:
+        return jsonify({'success': False, 'error': 'Vehicle selection required'}), 400
+    if not get_registry().owned_by(vehicle_id, session['user_id']):
+        return jsonify({'success': False, 'error': 'Invalid vehicle'}), 400
+    entry, created = waitlist.join(lot_id, session['user_id'], int(vehicle_id))
+    payload = waitlist.entry_payload(entry)
+    payload['success'] = True
+    payload['message'] = 'Added to waitlist' if created else 'Already on the waitlist'
+    return jsonify(payload)
+
+@parking_bp.route('/waitlist/entry/<int:entry_id>')
+def waitlist_status(entry_id):
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    entry = WaitlistEntry.query.get_or_404(entry_id)
+    if entry.user_id != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    waitlist.touch(entry)
+    timeout = min(request.args.get('wait', 0, type=float), 30)
+    if timeout > 0:
+        slots = waitlist.waiter_slots()
+        if not slots.acquire(blocking=False):
+            payload = waitlist.entry_payload(entry)
+            payload['retry_after'] = WAITLIST_RETRY_AFTER
+            response = jsonify(payload)
+            response.headers['Retry-After'] = str(WAITLIST_RETRY_AFTER)
+            return response
+        try:
+            entry = waitlist.wait_for_assignment(entry_id, timeout)
+        finally:
+            slots.release()
+    return jsonify(waitlist.entry_payload(entry))
+
+@parking_bp.route('/waitlist/entry/<int:entry_id>/cancel', methods=['POST'])
+def cancel_waitlist(entry_id):
+    if not session.get('user_id'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    entry = WaitlistEntry.query.get_or_404(entry_id)
+    if entry.user_id != session['user_id']:
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    cancelled = WaitlistEntry.query.filter_by(id=entry_id, status='W').update({'status': 'C'})
+    db.session.commit()
+    if not cancelled:
+        return jsonify({'success': False, 'error': 'Entry is no longer waiting'}), 400
+    return jsonify({'success': True, 'message': 'Left the waitlist'})
\ No newline at end of file
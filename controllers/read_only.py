@@ -0,0 +1,17 @@
+from functools import wraps
+from models.models import db
+from models.replicas import pinned_to_primary
+
+def read_only(view):
+    # Browse and report views run their queries on a replica when one is
+    # configured, unless the user wrote something in the last few seconds.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if pinned_to_primary():
+            return view(*args, **kwargs)
+        db.session.info['read_only'] = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            db.session.info.pop('read_only', None)
+    return wrapper
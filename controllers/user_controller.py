@@ -1,6 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from werkzeug.security import generate_password_hash, check_password_hash
 from models.models import db, User, Reservation, ParkingLot, ParkingSpot, Vehicle, to_ist_str
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from models.vehicle_registry import get_registry
+from models.shards import fan_out, fan_out_rows
+from models.timefmt import format_many, DISPLAY_TIMEZONES
+from controllers.read_only import read_only
 
 user_bp = Blueprint('user', __name__)
 
@@ -14,6 +20,7 @@ def login():
             session['user_id'] = user.id
             session['username'] = user.username
             session['is_admin'] = user.is_admin
+            session['timezone'] = user.display_timezone
             if user.is_admin:
                 return redirect(url_for('admin.dashboard'))
             else:
@@ -65,20 +72,23 @@ def edit_profile():
         full_name = request.form.get('full_name', '')
         address = request.form.get('address', '')
         pincode = request.form.get('pincode', '')
+        display_timezone = request.form.get('display_timezone', '')
         username_exists = User.query.filter(User.username == username, User.id != user.id).first()
         if username_exists:
             flash('Username already taken', 'error')
-            return render_template('edit_profile.html', user=user)
+            return render_template('edit_profile.html', user=user, timezones=DISPLAY_TIMEZONES)
         email_exists = User.query.filter(User.email == email, User.id != user.id).first()
         if email_exists:
             flash('Email already registered', 'error')
-            return render_template('edit_profile.html', user=user)
+            return render_template('edit_profile.html', user=user, timezones=DISPLAY_TIMEZONES)
         user.username = username
         user.email = email
         user.phone = phone
         user.full_name = full_name
         user.address = address
         user.pincode = pincode
+        user.display_timezone = display_timezone if display_timezone in DISPLAY_TIMEZONES else None
+        session['timezone'] = user.display_timezone
         if session['username'] != username:
             session['username'] = username
         current_password = request.form.get('current_password')
@@ -87,15 +97,15 @@ def edit_profile():
         if current_password and new_password and confirm_password:
             if not check_password_hash(user.password_hash, current_password):
                 flash('Current password is incorrect', 'error')
-                return render_template('edit_profile.html', user=user)
+                return render_template('edit_profile.html', user=user, timezones=DISPLAY_TIMEZONES)
             if new_password != confirm_password:
                 flash('New passwords do not match', 'error')
-                return render_template('edit_profile.html', user=user)
+                return render_template('edit_profile.html', user=user, timezones=DISPLAY_TIMEZONES)
             user.password_hash = generate_password_hash(new_password)
         db.session.commit()
         flash('Profile updated successfully', 'success')
         return redirect(url_for('index'))
-    return render_template('edit_profile.html', user=user)
+    return render_template('edit_profile.html', user=user, timezones=DISPLAY_TIMEZONES)
 
 @user_bp.route('/logout')
 def logout():
@@ -103,6 +113,7 @@ def logout():
     return redirect(url_for('index'))
 
 @user_bp.route('/dashboard')
+@read_only
 def dashboard():
     if not session.get('user_id') or session.get('is_admin'):
         return redirect(url_for('user.login'))
@@ -110,28 +121,42 @@ def dashboard():
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
     availability = request.args.get('availability', '')
-    query = ParkingLot.query
-    if search:
-        query = query.filter(
-            (ParkingLot.prime_location_name.contains(search)) |
-            (ParkingLot.address.contains(search)) |
-            (ParkingLot.pin_code.contains(search))
-        )
-    if min_price:
-        query = query.filter(ParkingLot.price_per_hour >= min_price)
-    if max_price:
-        query = query.filter(ParkingLot.price_per_hour <= max_price)
-    lots = query.all()
+    user_id = session['user_id']
+
+    def shard_lots():
+        query = ParkingLot.query.options(selectinload(ParkingLot.spots))
+        if search:
+            query = query.filter(
+                (ParkingLot.prime_location_name.contains(search)) |
+                (ParkingLot.address.contains(search)) |
+                (ParkingLot.pin_code.contains(search))
+            )
+        if min_price:
+            query = query.filter(ParkingLot.price_per_hour >= min_price)
+        if max_price:
+            query = query.filter(ParkingLot.price_per_hour <= max_price)
+        return query.all()
+
+    def shard_reservations():
+        return Reservation.query.options(
+            joinedload(Reservation.spot).joinedload(ParkingSpot.lot),
+            selectinload(Reservation.vehicle)
+        ).filter_by(
+            user_id=user_id,
+            leaving_timestamp=None
+        ).all()
+
+    lots = fan_out_rows(db, shard_lots)
     if availability == 'available':
         lots = [lot for lot in lots if any(spot.status == 'A' for spot in lot.spots)]
     elif availability == 'full':
         lots = [lot for lot in lots if all(spot.status == 'O' for spot in lot.spots)]
-    user_reservations = Reservation.query.filter_by(
-        user_id=session['user_id'],
-        leaving_timestamp=None
-    ).all()
+    user_reservations = fan_out_rows(db, shard_reservations)
+    from models.forecast import lot_forecast
+    forecasts = {lot.id: lot_forecast(lot) for lot in lots}
     return render_template('user_dashboard.html',
         lots=lots,
+        forecasts=forecasts,
         reservations=user_reservations,
         filters={
             'search': search,
@@ -144,35 +169,63 @@ def dashboard():
 def summary():
     if not session.get('user_id') or session.get('is_admin'):
         return redirect(url_for('user.login'))
-    user_parking_history = db.session.query(
-        Reservation,
-        ParkingSpot,
-        ParkingLot,
-        Vehicle
-    ).join(
-        ParkingSpot, Reservation.spot_id == ParkingSpot.id
-    ).join(
-        ParkingLot, ParkingSpot.lot_id == ParkingLot.id
-    ).join(
-        Vehicle, Reservation.vehicle_id == Vehicle.id
-    ).filter(
-        Reservation.user_id == session['user_id'],
-        Reservation.leaving_timestamp != None
-    ).order_by(
-        Reservation.parking_timestamp.desc()
-    ).all()
-    total_spent = db.session.query(
-        db.func.sum(Reservation.parking_cost)
-    ).filter(
-        Reservation.user_id == session['user_id'],
-        Reservation.leaving_timestamp != None
-    ).scalar() or 0
-    active_reservations = Reservation.query.filter_by(
-        user_id=session['user_id'],
-        leaving_timestamp=None
-    ).count()
+    user_id = session['user_id']
+
+    def shard_history():
+        history = db.session.query(
+            Reservation,
+            ParkingSpot,
+            ParkingLot
+        ).join(
+            ParkingSpot, Reservation.spot_id == ParkingSpot.id
+        ).join(
+            ParkingLot, ParkingSpot.lot_id == ParkingLot.id
+        ).filter(
+            Reservation.user_id == user_id,
+            Reservation.leaving_timestamp != None
+        ).all()
+        spent = db.session.query(
+            db.func.sum(Reservation.parking_cost)
+        ).filter(
+            Reservation.user_id == user_id,
+            Reservation.leaving_timestamp != None
+        ).scalar() or 0
+        active = Reservation.query.filter_by(
+            user_id=user_id,
+            leaving_timestamp=None
+        ).count()
+        return [tuple(row) for row in history], spent, active
+
+    # Reservations live with their lot's shard and vehicles in the primary,
+    # so the vehicles are looked up after the shards have answered.
+    shards = fan_out(db, shard_history)
+    history = [row for rows, _, _ in shards for row in rows]
+    vehicle_ids = {reservation.vehicle_id for reservation, _, _ in history}
+    vehicles = {
+        vehicle.id: vehicle
+        for vehicle in Vehicle.query.filter(Vehicle.id.in_(vehicle_ids))
+    } if vehicle_ids else {}
+    user_parking_history = sorted(
+        [
+            (reservation, spot, lot, vehicles[reservation.vehicle_id])
+            for reservation, spot, lot in history if reservation.vehicle_id in vehicles
+        ],
+        key=lambda row: row[0].parking_timestamp,
+        reverse=True
+    )
+    total_spent = sum(spent for _, spent, _ in shards)
+    active_reservations = sum(active for _, _, active in shards)
+    tz_name = session.get('timezone')
+    check_ins = [row[0].parking_timestamp for row in user_parking_history]
+    check_outs = [row[0].leaving_timestamp for row in user_parking_history]
+    history_times = list(zip(
+        format_many(check_ins, '%Y-%m-%d', tz_name),
+        format_many(check_ins, '%H:%M', tz_name),
+        format_many(check_outs, '%H:%M', tz_name)
+    ))
     return render_template('user_summary.html',
         parking_history=user_parking_history,
+        history_times=history_times,
         total_spent=total_spent,
         active_reservations=active_reservations)
 
@@ -193,8 +246,7 @@ def add_vehicle():
         if not vehicle_number:
             flash('Vehicle number is required', 'error')
             return render_template('add_vehicle.html')
-        existing = Vehicle.query.filter_by(vehicle_number=vehicle_number).first()
-        if existing:
+        if get_registry().plate_taken(vehicle_number):
             flash('Vehicle number already registered', 'error')
             return render_template('add_vehicle.html')
         vehicle = Vehicle(
@@ -203,7 +255,12 @@ def add_vehicle():
             vehicle_type=vehicle_type
         )
         db.session.add(vehicle)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Vehicle number already registered', 'error')
+            return render_template('add_vehicle.html')
         flash('Vehicle added successfully', 'success')
         return redirect(url_for('user.vehicles'))
     return render_template('add_vehicle.html')
@@ -222,13 +279,17 @@ def edit_vehicle(vehicle_id):
         if not vehicle_number:
             flash('Vehicle number is required', 'error')
             return render_template('edit_vehicle.html', vehicle=vehicle)
-        existing = Vehicle.query.filter(Vehicle.vehicle_number == vehicle_number, Vehicle.id != vehicle_id).first()
-        if existing:
+        if get_registry().plate_taken(vehicle_number, exclude_id=vehicle_id):
             flash('Vehicle number already registered', 'error')
             return render_template('edit_vehicle.html', vehicle=vehicle)
         vehicle.vehicle_number = vehicle_number
         vehicle.vehicle_type = vehicle_type
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('Vehicle number already registered', 'error')
+            return render_template('edit_vehicle.html', vehicle=vehicle)
         flash('Vehicle updated successfully', 'success')
         return redirect(url_for('user.vehicles'))
     return render_template('edit_vehicle.html', vehicle=vehicle)
\ No newline at end of file
@@ -0,0 +1,290 @@
+import heapq
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .models import db, ParkingSpot
+from .layout import DEFAULT_SIZE, SIZE_CLASSES, fitting_sizes
+from .replicas import on_primary
+from .shards import on_shard, shard_of
+
+class LotAllocator:
+    # Free spots of one lot, in a heap per (floor, size class) keyed by
+    # distance from the entrance. A pick compares the heads of each floor's
+    # heap for the smallest size class the vehicle fits, plus a penalty that
+    # grows with the floor's occupancy so cars spread over the floors instead
+    # of filling the ground floor first: O(floors + log n) per pick.
+
+    def __init__(self, spots, floor_balance=None):
+        # spots: (id, floor, distance, size_class, status) tuples.
+        self._spots = {}
+        self._free = set()
+        self._heaps = {}
+        self._floor_total = {}
+        self._floor_occupied = {}
+        self._size_total = {}
+        self._stale_entries = 0
+        for spot in spots:
+            self.add(*spot)
+        if floor_balance is None:
+            # One garage's length of walking per 100% difference in fill.
+            distances = [spot[1] for spot in self._spots.values()]
+            floor_balance = max(distances) - min(distances) if distances else 0.0
+        self.floor_balance = floor_balance
+
+    def add(self, spot_id, floor, distance, size_class, status='A'):
+        self.remove(spot_id)
+        floor = floor or 0
+        size_class = size_class or DEFAULT_SIZE
+        self._spots[spot_id] = (floor, distance or 0.0, size_class)
+        self._floor_total[floor] = self._floor_total.get(floor, 0) + 1
+        self._size_total[size_class] = self._size_total.get(size_class, 0) + 1
+        self._floor_occupied.setdefault(floor, 0)
+        if status == 'A':
+            self._push(spot_id)
+        else:
+            self._floor_occupied[floor] += 1
+
+    def remove(self, spot_id):
+        spot = self._spots.pop(spot_id, None)
+        if spot is None:
+            return
+        self._floor_total[spot[0]] -= 1
+        self._size_total[spot[2]] -= 1
+        if spot_id in self._free:
+            self._free.discard(spot_id)
+            self._stale_entries += 1
+        else:
+            self._floor_occupied[spot[0]] -= 1
+
+    def occupy(self, spot_id):
+        if spot_id in self._free:
+            self._free.discard(spot_id)
+            self._floor_occupied[self._spots[spot_id][0]] += 1
+            self._stale_entries += 1
+
+    def release(self, spot_id):
+        if spot_id in self._spots and spot_id not in self._free:
+            self._floor_occupied[self._spots[spot_id][0]] -= 1
+            self._push(spot_id)
+
+    def _push(self, spot_id):
+        floor, distance, size_class = self._spots[spot_id]
+        self._free.add(spot_id)
+        heapq.heappush(self._heaps.setdefault((floor, size_class), []), (distance, spot_id))
+        if self._stale_entries > len(self._spots) + 64:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._heaps = {}
+        for spot_id in self._free:
+            floor, distance, size_class = self._spots[spot_id]
+            self._heaps.setdefault((floor, size_class), []).append((distance, spot_id))
+        for heap in self._heaps.values():
+            heapq.heapify(heap)
+        self._stale_entries = 0
+
+    def _head(self, key):
+        # Occupied and moved spots stay in the heaps until they reach the top.
+        heap = self._heaps.get(key)
+        while heap:
+            distance, spot_id = heap[0]
+            if spot_id in self._free and self._spots[spot_id] == (key[0], distance, key[1]):
+                return heap[0]
+            heapq.heappop(heap)
+            self._stale_entries -= 1
+        return None
+
+    def sizes_for(self, vehicle_type):
+        # A lot with no spot of any class the vehicle fits parks it in its
+        # largest class rather than turning it away for good.
+        sizes = fitting_sizes(vehicle_type)
+        if any(self._size_total.get(size) for size in sizes):
+            return sizes
+        return [size for size in SIZE_CLASSES if self._size_total.get(size)][-1:]
+
+    def pick(self, vehicle_type=None):
+        for size_class in self.sizes_for(vehicle_type):
+            best = None
+            for floor, total in self._floor_total.items():
+                head = self._head((floor, size_class))
+                if head is None:
+                    continue
+                score = head[0] + self.floor_balance * self._floor_occupied[floor] / total
+                if best is None or score < best[0]:
+                    best = (score, floor)
+            if best is not None:
+                _, spot_id = heapq.heappop(self._heaps[(best[1], size_class)])
+                self.occupy(spot_id)
+                self._stale_entries -= 1
+                return spot_id
+        return None
+
+    def layout(self, spot_id):
+        return self._spots.get(spot_id)
+
+    def floor_occupancy(self):
+        return {
+            floor: (self._floor_occupied[floor], total)
+            for floor, total in sorted(self._floor_total.items())
+        }
+
+class SpotAllocator:
+    # Per-process allocators for each lot, loaded on first use. Spot changes
+    # committed by this process are applied on commit; a lot is reloaded
+    # after max_age seconds to pick up other workers' bookings.
+
+    def __init__(self, max_age=300, floor_balance=None):
+        self.max_age = max_age
+        self.floor_balance = floor_balance
+        self._lock = threading.Lock()
+        self._lots = {}
+
+    def _lot(self, lot_id):
+        entry = self._lots.get(lot_id)
+        if entry is None or time.monotonic() - entry[0] > self.max_age:
+            return self.reload(lot_id)
+        return entry[1]
+
+    def reload(self, lot_id):
+        with on_primary(db.session), on_shard(db.session, shard_of(lot_id)):
+            rows = db.session.query(
+                ParkingSpot.id, ParkingSpot.floor, ParkingSpot.distance, ParkingSpot.size_class, ParkingSpot.status
+            ).filter_by(lot_id=lot_id).all()
+        lot = LotAllocator(rows, self.floor_balance)
+        with self._lock:
+            self._lots[lot_id] = (time.monotonic(), lot)
+        return lot
+
+    def invalidate(self):
+        with self._lock:
+            self._lots = {}
+
+    def take(self, lot_id, vehicle_type=None):
+        lot = self._lot(lot_id)
+        with self._lock:
+            spot_id = lot.pick(vehicle_type)
+        if spot_id is not None:
+            db.session.info.setdefault('spot_claims', {})[spot_id] = lot_id
+        return spot_id
+
+    def sizes_for(self, lot_id, vehicle_type):
+        lot = self._lot(lot_id)
+        with self._lock:
+            return lot.sizes_for(vehicle_type)
+
+    def drop_claim(self, spot_id):
+        # The spot turned out to be taken already; leave it out of the heaps.
+        db.session.info.get('spot_claims', {}).pop(spot_id, None)
+
+    def apply(self, changes, returned):
+        with self._lock:
+            for spot_id, change in changes.items():
+                entry = self._lots.get(change['lot_id'])
+                if entry is None:
+                    continue
+                lot = entry[1]
+                if change['deleted']:
+                    lot.remove(spot_id)
+                elif change['was'] is None or change['layout'] != lot.layout(spot_id):
+                    lot.add(spot_id, *change['layout'], change['status'])
+                elif change['status'] == 'A':
+                    lot.release(spot_id)
+                else:
+                    lot.occupy(spot_id)
+            for spot_id, lot_id in returned.items():
+                entry = self._lots.get(lot_id)
+                if entry is not None:
+                    entry[1].release(spot_id)
+
+    def floor_occupancy(self, lot_id):
+        lot = self._lot(lot_id)
+        with self._lock:
+            return lot.floor_occupancy()
+
+def get_allocator():
+    allocator = current_app.extensions.get('spot_allocator')
+    if allocator is None:
+        allocator = current_app.extensions.setdefault(
+            'spot_allocator',
+            SpotAllocator(
+                current_app.config.get('ALLOCATOR_MAX_AGE', 300),
+                current_app.config.get('ALLOCATOR_FLOOR_BALANCE')
+            )
+        )
+    return allocator
+
+def allocate_spot(lot_id, vehicle_type=None):
+    allocator = get_allocator()
+    for attempt in range(2):
+        spot_id = allocator.take(lot_id, vehicle_type)
+        while spot_id is not None:
+            spot = db.session.get(ParkingSpot, spot_id)
+            if spot is not None and spot.status == 'A':
+                return spot
+            allocator.drop_claim(spot_id)
+            spot_id = allocator.take(lot_id, vehicle_type)
+        # Looks full from here; another worker may have freed a spot since
+        # the last reload.
+        free = ParkingSpot.query.filter(
+            ParkingSpot.lot_id == lot_id,
+            ParkingSpot.status == 'A',
+            ParkingSpot.size_class.in_(allocator.sizes_for(lot_id, vehicle_type))
+        ).first()
+        if free is None or attempt:
+            return None
+        allocator.reload(lot_id)
+    return None
+
+@event.listens_for(Session, 'after_flush')
+def _track_spot_changes(session, flush_context):
+    pending = session.info.setdefault('spot_changes', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if not isinstance(obj, ParkingSpot):
+            continue
+        change = pending.get(obj.id)
+        if change is None:
+            history = inspect(obj).attrs.status.history
+            was = None if obj in session.new else (history.deleted[0] if history.deleted else obj.status)
+            change = pending[obj.id] = {'was': was}
+        change.update(
+            lot_id=obj.lot_id,
+            layout=(obj.floor or 0, obj.distance or 0.0, obj.size_class or DEFAULT_SIZE),
+            status=obj.status,
+            deleted=obj in session.deleted
+        )
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_spot_statements(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ is ParkingSpot:
+        orm_execute_state.session.info['spot_changes_bulk'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _apply_spot_changes(session):
+    changes = session.info.pop('spot_changes', {})
+    claims = session.info.pop('spot_claims', {})
+    bulk = session.info.pop('spot_changes_bulk', False)
+    if not has_app_context() or not (changes or claims or bulk):
+        return
+    allocator = get_allocator()
+    if bulk:
+        allocator.invalidate()
+        return
+    # Claimed spots that were not booked in this transaction go back.
+    returned = {
+        spot_id: lot_id for spot_id, lot_id in claims.items()
+        if changes.get(spot_id, {}).get('status') != 'O'
+    }
+    allocator.apply(changes, returned)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_spot_changes(session, previous_transaction):
+    session.info.pop('spot_changes', None)
+    session.info.pop('spot_changes_bulk', None)
+    claims = session.info.pop('spot_claims', None)
+    if claims and has_app_context():
+        get_allocator().apply({}, claims)
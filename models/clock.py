@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+
+class SystemClock:
+    def now(self):
+        return datetime.utcnow()
+
+class SimulatedClock:
+    # Time only moves when told to: used by tests and the capacity simulator.
+
+    def __init__(self, start):
+        self._now = start
+
+    def now(self):
+        return self._now
+
+    def set(self, moment):
+        self._now = moment
+
+    def advance(self, **delta):
+        self._now += timedelta(**delta)
+        return self._now
+
+SYSTEM_CLOCK = SystemClock()
+
+def install_clock(app, clock):
+    app.extensions['clock'] = clock
+
+def utcnow():
+    # Naive UTC "now" from the app's clock, or the system clock outside an app.
+    if has_app_context():
+        return current_app.extensions.get('clock', SYSTEM_CLOCK).now()
+    return SYSTEM_CLOCK.now()
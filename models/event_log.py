@@ -0,0 +1,450 @@
+import json
+import os
+import threading
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+from datetime import datetime, timezone
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .models import db, ParkingSpot, Reservation
+from .clock import utcnow
+from .shards import on_shard, shard_count, shard_of
+
+SEGMENT_PREFIX = 'events-'
+CHECKPOINT_FILE = 'checkpoint'
+LOCK_FILE = 'lock'
+TAIL_CHUNK = 64 * 1024
+WRITER_PREFIX = 'writer-'
+
+def _try_lock(file):
+    try:
+        if fcntl:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+def _encode(event):
+    payload = json.dumps(event, separators=(',', ':'), default=str).encode()
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+def _decode(line):
+    crc, _, payload = line.rstrip(b'\n').partition(b' ')
+    try:
+        if int(crc, 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+class ReservationEventLog:
+    # Append-only log of booking/release events, one CRC-prefixed JSON line per
+    # event, split into size-capped segment files. append() returns once the
+    # event is on disk; concurrent appenders share a single fsync (group commit).
+    # resolve() adds a commit record once the transaction holding the events
+    # has committed, and segments wholly at or below the checkpoint are deleted.
+    # A directory has one writer process at a time, held by an OS lock on its
+    # lock file; opening one that is in use raises BlockingIOError.
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024, group_commit=True):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.group_commit = group_commit
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, LOCK_FILE), 'ab')
+        if not _try_lock(self._lock_file):
+            self._lock_file.close()
+            raise BlockingIOError(f'{directory} is in use by another process')
+        self._lock = threading.Lock()
+        self._synced = threading.Condition(self._lock)
+        self._syncing = False
+        self._file = None
+        segments = self.segments()
+        self._checkpoint = self.read_checkpoint()
+        # The segments holding the last events may have been dropped once the
+        # checkpoint passed them; seqs carry on from the checkpoint then.
+        self._written_seq = max(self._recover_tail(segments), self._checkpoint)
+        self._durable_seq = self._written_seq
+        self._segment_index = segments[-1][0] if segments else 1
+        self._segment_starts = self._read_segment_starts(segments)
+        # Appended seqs whose transaction has neither committed nor aborted.
+        self._unresolved = set()
+        self._checkpoint_lock = threading.Lock()
+        self._open_segment()
+
+    def _recover_tail(self, segments):
+        # Only the end of the newest segment can be torn by a crash, so this
+        # reads backwards from the end instead of scanning the whole log, cuts
+        # off anything after the last intact event and returns its seq.
+        for _, path in reversed(segments):
+            with open(path, 'r+b') as f:
+                end = f.seek(0, os.SEEK_END)
+                chunk = TAIL_CHUNK
+                while True:
+                    pos = max(end - chunk, 0)
+                    f.seek(pos)
+                    tail = f.read(end - pos)
+                    stop = len(tail)
+                    while True:
+                        newline = tail.rfind(b'\n', 0, stop)
+                        start = tail.rfind(b'\n', 0, max(newline, 0)) + 1
+                        if newline < 0 or (start == 0 and pos > 0):
+                            break
+                        event = _decode(tail[start:newline + 1])
+                        if event is not None:
+                            if pos + newline + 1 < end:
+                                f.truncate(pos + newline + 1)
+                                os.fsync(f.fileno())
+                            return event['seq']
+                        stop = start
+                    if pos == 0:
+                        break
+                    chunk *= 2
+                f.truncate(0)
+                os.fsync(f.fileno())
+        return 0
+
+    def _read_segment_starts(self, segments):
+        # (index, first seq) per segment; an empty segment starts where the
+        # next one does.
+        starts = []
+        first = self._written_seq + 1
+        for index, path in reversed(segments):
+            with open(path, 'rb') as f:
+                event = _decode(f.readline())
+            if event is not None:
+                first = event['seq']
+            starts.append((index, first))
+        starts.reverse()
+        return starts or [(1, first)]
+
+    def segments(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith('.log'):
+                found.append((int(name[len(SEGMENT_PREFIX):-4]), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def _segment_path(self, index):
+        return os.path.join(self.directory, f'{SEGMENT_PREFIX}{index:06d}.log')
+
+    def _open_segment(self):
+        self._file = open(self._segment_path(self._segment_index), 'ab')
+
+    def _write(self, record):
+        # Caller holds self._lock.
+        self._written_seq += 1
+        seq = self._written_seq
+        self._file.write(_encode(dict(record, seq=seq)))
+        if self._file.tell() >= self.segment_size:
+            while self._syncing:
+                self._synced.wait()
+            self._flush()
+            self._durable_seq = self._written_seq
+            self._file.close()
+            self._segment_index += 1
+            self._segment_starts.append((self._segment_index, self._written_seq + 1))
+            self._open_segment()
+        return seq
+
+    def append(self, event):
+        with self._lock:
+            seq = self._write(event)
+            self._unresolved.add(seq)
+            if not self.group_commit:
+                self._flush()
+                self._durable_seq = seq
+                return seq
+            # The first waiter becomes the leader and fsyncs everything written
+            # so far; the others sleep until their seq is covered.
+            while self._durable_seq < seq:
+                if self._syncing:
+                    self._synced.wait()
+                    continue
+                self._syncing = True
+                target = self._written_seq
+                file = self._file
+                file.flush()
+                self._lock.release()
+                try:
+                    os.fsync(file.fileno())
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                self._durable_seq = max(self._durable_seq, target)
+                self._synced.notify_all()
+            return seq
+
+    def _flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def resolve(self, seqs, committed=True):
+        # Called once the transaction holding seqs has committed or aborted;
+        # moves the checkpoint up to the oldest event still in flight. The
+        # commit record is not fsynced: if a crash loses it, replay skips
+        # events whose effect is already in the database.
+        with self._lock:
+            if committed:
+                self._write({'type': 'commit', 'seqs': sorted(seqs)})
+                self._file.flush()
+            self._unresolved.difference_update(seqs)
+            checkpoint = min(self._unresolved) - 1 if self._unresolved else self._written_seq
+        with self._checkpoint_lock:
+            if checkpoint > self._checkpoint:
+                # Not fsynced: a checkpoint lost in a crash only means
+                # replaying events that already applied, which is harmless.
+                self._store_checkpoint(checkpoint, sync=False)
+
+    def pending(self):
+        return self._written_seq > self._checkpoint
+
+    def read(self, after_seq=0):
+        with self._lock:
+            starts = list(self._segment_starts)
+        for position, (index, _) in enumerate(starts):
+            if position + 1 < len(starts) and starts[position + 1][1] <= after_seq + 1:
+                # Every event in this segment is at or below after_seq.
+                continue
+            try:
+                f = open(self._segment_path(index), 'rb')
+            except FileNotFoundError:
+                # Dropped by the checkpoint while we were reading.
+                continue
+            with f:
+                for line in f:
+                    event = _decode(line)
+                    if event is None:
+                        # Torn write from a crash: nothing after it was acknowledged.
+                        return
+                    if event['seq'] > after_seq:
+                        yield event
+
+    def read_checkpoint(self):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+
+    def write_checkpoint(self, seq):
+        with self._checkpoint_lock:
+            self._store_checkpoint(seq, sync=True)
+
+    def _store_checkpoint(self, seq, sync):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(seq))
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        self._checkpoint = seq
+        self._drop_segments(seq)
+
+    def _drop_segments(self, checkpoint):
+        # Segments that end at or below the checkpoint are never read again.
+        # The segment being written is always kept.
+        with self._lock:
+            dropped = []
+            while len(self._segment_starts) > 1 and self._segment_starts[1][1] - 1 <= checkpoint:
+                dropped.append(self._segment_starts.pop(0)[0])
+        for index in dropped:
+            try:
+                os.remove(self._segment_path(index))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._flush()
+                self._file.close()
+                self._file = None
+            if not self._lock_file.closed:
+                self._lock_file.close()
+
+def open_event_log(root, **options):
+    # Each worker process writes its own directory under root, reusing one
+    # left by a process that has exited.
+    index = 1
+    while True:
+        try:
+            return ReservationEventLog(os.path.join(root, f'{WRITER_PREFIX}{index:03d}'), **options)
+        except BlockingIOError:
+            index += 1
+
+def idle_event_logs(root):
+    # Logs whose writer is no longer running; live writers keep theirs locked.
+    if not os.path.isdir(root):
+        return
+    for name in sorted(os.listdir(root)):
+        if name.startswith(WRITER_PREFIX):
+            try:
+                yield ReservationEventLog(os.path.join(root, name))
+            except BlockingIOError:
+                continue
+
+def init_event_log(app):
+    root = app.config.get('EVENT_LOG_DIR')
+    if not root:
+        return
+    log = open_event_log(root, group_commit=app.config.get('EVENT_LOG_GROUP_COMMIT', True))
+    app.extensions['event_log'] = log
+    if log.pending():
+        # The previous writer of this directory died between logging an event
+        # and committing it.
+        with app.app_context():
+            if inspect(db.engine).has_table(Reservation.__tablename__):
+                replay_events(log)
+
+def current_event_log():
+    return current_app.extensions.get('event_log')
+
+def _iso(dt):
+    # Timestamps are stored as naive UTC; new rows may still carry tzinfo.
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.isoformat()
+
+def _reservation_event(event_type, reservation):
+    return {
+        'type': event_type,
+        'reservation_id': reservation.id,
+        'spot_id': reservation.spot_id,
+        'user_id': reservation.user_id,
+        'vehicle_id': reservation.vehicle_id,
+        'parking_timestamp': _iso(reservation.parking_timestamp),
+        'leaving_timestamp': _iso(reservation.leaving_timestamp),
+        'parking_cost': reservation.parking_cost
+    }
+
+def commit_logged(event_type, reservation, followups=()):
+    # Writes the events ahead of the relational commit and a commit record
+    # after it. followups are extra (event_type, reservation) pairs committed
+    # in the same transaction. Events without a commit record (rolled back, or
+    # the process died before the commit) were never acknowledged to the
+    # client and are not replayed.
+    # Nothing is flushed before the append: SQLite takes its write lock on the
+    # first flushed change, and holding it through the fsync would leave group
+    # commit nothing to batch. A new reservation has no id yet; replay finds
+    # it by spot, user and parking_timestamp instead.
+    log = current_event_log()
+    if log is None:
+        db.session.commit()
+        return
+    if reservation.parking_timestamp is None:
+        reservation.parking_timestamp = utcnow()
+    seqs = db.session.info.setdefault('logged_seqs', [])
+    seqs.append(log.append(_reservation_event(event_type, reservation)))
+    for followup_type, followup in followups:
+        seqs.append(log.append(_reservation_event(followup_type, followup)))
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+@event.listens_for(Session, 'after_commit')
+def _resolve_logged_events(session):
+    seqs = session.info.pop('logged_seqs', None)
+    if seqs and has_app_context() and current_event_log():
+        current_event_log().resolve(seqs)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _abort_logged_events(session, previous_transaction):
+    seqs = session.info.pop('logged_seqs', None)
+    if seqs and has_app_context() and current_event_log():
+        current_event_log().resolve(seqs, committed=False)
+
+def _parse(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _find_reservation(event):
+    if event['reservation_id'] is not None:
+        return db.session.get(Reservation, event['reservation_id'])
+    return Reservation.query.filter_by(
+        spot_id=event['spot_id'],
+        user_id=event['user_id'],
+        parking_timestamp=_parse(event['parking_timestamp'])
+    ).first()
+
+def _spot_is_free(spot):
+    return spot.status == 'A' and not Reservation.query.filter_by(spot_id=spot.id, leaving_timestamp=None).first()
+
+def replay_events(log, from_checkpoint=True):
+    # Re-applies committed events to the reservation and spot tables. An event
+    # whose effect is already in the database is skipped, so replaying is safe.
+    # Spots are deleted with their lot (and their reservations), which is not
+    # logged: events for a missing spot (or a shard no longer configured) are
+    # dropped, and so is a booking whose spot has been taken since or a
+    # release of a reservation that is gone.
+    after = log.read_checkpoint() if from_checkpoint else 0
+    events = list(log.read(after))
+    committed = set()
+    for event in events:
+        if event['type'] == 'commit':
+            committed.update(event['seqs'])
+    applied = 0
+    with on_shard(db.session, 0):
+        for event in events:
+            if event['type'] not in ('book', 'release') or event['seq'] not in committed:
+                continue
+            shard = shard_of(event['spot_id'])
+            if shard >= shard_count(db):
+                continue
+            if shard != db.session.info['shard']:
+                # Flushes go to the session's current shard.
+                db.session.flush()
+                db.session.info['shard'] = shard
+            spot = db.session.get(ParkingSpot, event['spot_id'])
+            if spot is None:
+                continue
+            reservation = _find_reservation(event)
+            if reservation is None:
+                if event['type'] != 'book' or not _spot_is_free(spot):
+                    continue
+                reservation = Reservation(
+                    id=event['reservation_id'],
+                    spot_id=event['spot_id'],
+                    user_id=event['user_id'],
+                    vehicle_id=event['vehicle_id'],
+                    parking_timestamp=_parse(event['parking_timestamp'])
+                )
+                db.session.add(reservation)
+            elif reservation.leaving_timestamp is not None:
+                # Released since: neither a late book nor a repeated release may
+                # touch a spot that may have been booked again.
+                continue
+            if event['type'] == 'book':
+                reservation.parking_cost = event['parking_cost']
+                spot.status = 'O'
+            elif event['type'] == 'release':
+                reservation.leaving_timestamp = _parse(event['leaving_timestamp'])
+                reservation.parking_cost = event['parking_cost']
+                spot.status = 'A'
+            applied += 1
+        db.session.commit()
+    if events:
+        log.write_checkpoint(events[-1]['seq'])
+    return applied
+
+def replay_all():
+    # This process's log and those left by writers that are no longer running.
+    log = current_event_log()
+    applied = replay_events(log)
+    for idle in idle_event_logs(os.path.dirname(log.directory)):
+        try:
+            applied += replay_events(idle)
+        finally:
+            idle.close()
+    return applied
@@ -0,0 +1,166 @@
+import threading
+import time
+from datetime import timedelta
+from flask import current_app
+from pytz import timezone, utc
+from .models import db, ParkingSpot, Reservation, LotForecast, ForecastState, ForecastOpenReservation
+from .clock import utcnow
+from .replicas import on_primary
+from .shards import fan_out, shard_of
+
+def hour_of_week(dt, tz_name='Asia/Kolkata'):
+    if dt.tzinfo is None:
+        dt = utc.localize(dt)
+    local = dt.astimezone(timezone(tz_name))
+    return local.weekday() * 24 + local.hour
+
+class ForecastCache:
+    # Per-process copy of the LotForecast tables of all shards for
+    # constant-time lookups. Every check_interval seconds the ForecastState
+    # versions are compared with the loaded ones, so a refresh run by the
+    # batch process reaches the web workers without a restart.
+
+    def __init__(self, check_interval=60):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._version = None
+        self._history_start = {}
+        self._hours = {}
+
+    def _ensure_current(self):
+        if self._checked_at is not None and time.monotonic() - self._checked_at <= self.check_interval:
+            return
+        with on_primary(db.session):
+            version = tuple(fan_out(db, _shard_version))
+        if self._checked_at is None or version != self._version:
+            self.reload()
+        else:
+            self._checked_at = time.monotonic()
+
+    def reload(self):
+        with on_primary(db.session):
+            shards = fan_out(db, _load_shard)
+        with self._lock:
+            self._version = tuple(state[0] if state else None for state, _ in shards)
+            self._history_start = {shard: state[1] for shard, (state, _) in enumerate(shards) if state}
+            self._hours = {(lot_id, hour): occupied for _, rows in shards for lot_id, hour, occupied in rows}
+            self._checked_at = time.monotonic()
+
+    def expected_occupied(self, lot_id, at, now):
+        self._ensure_current()
+        with self._lock:
+            occupied = self._hours.get((lot_id, hour_of_week(at)), 0.0)
+            history_start = self._history_start.get(shard_of(lot_id))
+        if not history_start:
+            return occupied
+        weeks = max((now - history_start).total_seconds() / (7 * 24 * 3600), 1.0)
+        return occupied / weeks
+
+def _shard_version():
+    return db.session.query(ForecastState.version).filter_by(id=1).scalar()
+
+def _load_shard():
+    state = db.session.query(ForecastState.version, ForecastState.history_start).filter_by(id=1).first()
+    rows = db.session.query(LotForecast.lot_id, LotForecast.hour_of_week, LotForecast.occupied_hours).all()
+    return (tuple(state) if state else None), [tuple(row) for row in rows]
+
+def get_forecasts():
+    forecasts = current_app.extensions.get('forecasts')
+    if forecasts is None:
+        forecasts = current_app.extensions.setdefault(
+            'forecasts',
+            ForecastCache(current_app.config.get('FORECAST_CHECK_INTERVAL', 60))
+        )
+    return forecasts
+
+def refresh_forecasts(now=None):
+    # Each shard keeps its own ForecastState and LotForecast rows, so the
+    # shards are folded in parallel and the cache reloaded once after.
+    now = now or utcnow()
+    folded = sum(fan_out(db, lambda: _refresh_shard(now)))
+    get_forecasts().reload()
+    return folded
+
+def _refresh_shard(now):
+    # Folds reservations closed since the last run into the per-lot
+    # hour-of-week totals. Overlapping runs (e.g. the batch loop and a manual
+    # run) are serialised by a compare-and-set on ForecastState.version:
+    # the loser rolls back instead of folding the same reservations twice.
+    from .reports import closed_since, utilization_heatmap
+    if db.session.get(ForecastState, 1) is None:
+        db.session.add(ForecastState(id=1, last_reservation_id=0, version=0))
+        db.session.commit()
+    watermark, history_start, version = db.session.query(
+        ForecastState.last_reservation_id, ForecastState.history_start, ForecastState.version
+    ).filter_by(id=1).one()
+    open_ids = [reservation_id for reservation_id, in db.session.query(ForecastOpenReservation.reservation_id)]
+    rows, watermark, open_ids = closed_since(
+        watermark or 0,
+        open_ids,
+        Reservation.id,
+        ParkingSpot.lot_id,
+        Reservation.parking_timestamp,
+        Reservation.leaving_timestamp
+    )
+    by_lot = {}
+    for row in rows:
+        columns = by_lot.setdefault(row.lot_id, {'parking_timestamp': [], 'leaving_timestamp': []})
+        columns['parking_timestamp'].append(utc.localize(row.parking_timestamp).timestamp())
+        columns['leaving_timestamp'].append(utc.localize(row.leaving_timestamp).timestamp())
+        if history_start is None or row.parking_timestamp < history_start:
+            history_start = row.parking_timestamp
+    claimed = ForecastState.query.filter(
+        ForecastState.id == 1,
+        ForecastState.version == version
+    ).update({
+        'last_reservation_id': watermark,
+        'history_start': history_start,
+        'updated_at': now,
+        'version': version + 1
+    }, synchronize_session=False)
+    if not claimed:
+        db.session.rollback()
+        return 0
+    existing = {
+        (f.lot_id, f.hour_of_week): f
+        for f in LotForecast.query.filter(LotForecast.lot_id.in_(list(by_lot))).all()
+    } if by_lot else {}
+    for lot_id, columns in by_lot.items():
+        grid = utilization_heatmap(columns)
+        for day, hours in enumerate(grid):
+            for hour, value in enumerate(hours):
+                if not value:
+                    continue
+                key = (lot_id, day * 24 + hour)
+                forecast = existing.get(key)
+                if not forecast:
+                    forecast = LotForecast(lot_id=lot_id, hour_of_week=key[1], occupied_hours=0.0)
+                    db.session.add(forecast)
+                    existing[key] = forecast
+                forecast.occupied_hours += value
+    ForecastOpenReservation.query.delete()
+    db.session.add_all(ForecastOpenReservation(reservation_id=reservation_id) for reservation_id in open_ids)
+    db.session.commit()
+    return len(rows)
+
+def expected_free(lot_id, total_spots, occupied_now, minutes, now=None):
+    # Shifts the current occupancy by the historical change between now and
+    # the target hour, so a lot that is busier than usual stays busier.
+    now = now or utcnow()
+    later = now + timedelta(minutes=minutes)
+    forecasts = get_forecasts()
+    delta = forecasts.expected_occupied(lot_id, later, now) - forecasts.expected_occupied(lot_id, now, now)
+    occupied = min(max(occupied_now + delta, 0), total_spots)
+    return int(round(total_spots - occupied))
+
+def lot_forecast(lot, now=None):
+    now = now or utcnow()
+    total = len(lot.spots)
+    occupied = sum(1 for spot in lot.spots if spot.status == 'O')
+    return {
+        'lot_id': lot.id,
+        'available_now': total - occupied,
+        'expected_free_30': expected_free(lot.id, total, occupied, 30, now),
+        'expected_free_60': expected_free(lot.id, total, occupied, 60, now)
+    }
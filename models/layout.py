@@ -0,0 +1,47 @@
+from string import ascii_uppercase
+
+# Spot size classes, smallest first. A vehicle fits its own class or larger.
+SIZE_CLASSES = ['S', 'M', 'L', 'XL']
+VEHICLE_SIZES = {
+    'Bike': 'S',
+    'Car': 'M',
+    'Other': 'M',
+    'SUV': 'L',
+    'Van': 'L',
+    'Truck': 'XL'
+}
+DEFAULT_SIZE = 'M'
+ROW_LENGTH = 10
+# Size class by position in each row of ten: one bike bay, one large and one
+# extra-large bay.
+ROW_SIZES = {0: 'S', 8: 'L', 9: 'XL'}
+
+def size_for(vehicle_type):
+    return VEHICLE_SIZES.get(vehicle_type or '', DEFAULT_SIZE)
+
+def fitting_sizes(vehicle_type):
+    return SIZE_CLASSES[SIZE_CLASSES.index(size_for(vehicle_type)):]
+
+def fits(vehicle_type, size_class):
+    return (size_class or DEFAULT_SIZE) in fitting_sizes(vehicle_type)
+
+def generate_layout(prefix, count, floors=1, row_length=ROW_LENGTH, spacing=2.5, ramp_length=40.0, sizes=None):
+    # Spots are spread evenly over the floors and laid out in rows (zones)
+    # walking away from the entrance; each floor up adds one ramp length.
+    # sizes optionally maps a position within a row to a size class.
+    floors = max(1, min(floors, count or 1))
+    per_floor, extra = divmod(count, floors)
+    layout = []
+    number = 1
+    for floor in range(floors):
+        for position in range(per_floor + (floor < extra)):
+            row, column = divmod(position, row_length)
+            layout.append({
+                'spot_number': f'{prefix}{number:02d}',
+                'floor': floor,
+                'zone': ascii_uppercase[row % 26],
+                'distance': floor * ramp_length + (row * row_length + column) * spacing,
+                'size_class': (sizes or {}).get(column, DEFAULT_SIZE)
+            })
+            number += 1
+    return layout
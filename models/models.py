@@ -1,9 +1,30 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import event
 from werkzeug.security import generate_password_hash
-from pytz import timezone, utc
+from .layout import ROW_SIZES, generate_layout
+from .replicas import RoutingSession
+from .clock import utcnow
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+def set_sqlite_pragmas(engine, journal_mode='WAL'):
+    # WAL lets browse traffic read while a booking holds the write lock, and
+    # busy_timeout makes concurrent writers queue instead of failing.
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+def sharded(*args, autoincrement=True):
+    # __table_args__ for the tables split across shards (models/shards.py).
+    # AUTOINCREMENT keeps SQLite from reusing ids, so each shard's sequence
+    # stays inside its own range.
+    return args + ({'info': {'sharded': True}, 'sqlite_autoincrement': autoincrement},)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -15,25 +36,33 @@ class User(db.Model):
     address = db.Column(db.Text)
     pincode = db.Column(db.String(10))
     is_admin = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(utc))
+    display_timezone = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime, default=utcnow)
     reservations = db.relationship('Reservation', backref='user', lazy=True)
     vehicles = db.relationship('Vehicle', backref='owner', lazy=True)
 
 class ParkingLot(db.Model):
+    __table_args__ = sharded()
     id = db.Column(db.Integer, primary_key=True)
     prime_location_name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.Text, nullable=False)
     pin_code = db.Column(db.String(10), nullable=False)
     price_per_hour = db.Column(db.Float, nullable=False)
     maximum_number_of_spots = db.Column(db.Integer, nullable=False)
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
     spots = db.relationship('ParkingSpot', backref='lot', lazy=True, cascade='all, delete-orphan')
 
 class ParkingSpot(db.Model):
+    __table_args__ = sharded(db.Index('ix_spot_lot_status', 'lot_id', 'status'))
     id = db.Column(db.Integer, primary_key=True)
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
     spot_number = db.Column(db.String(10), nullable=False)
     status = db.Column(db.String(1), default='A')
+    floor = db.Column(db.Integer, default=0)
+    zone = db.Column(db.String(10))
+    # Walking distance from the lot entrance in metres, including ramps.
+    distance = db.Column(db.Float, default=0.0)
+    size_class = db.Column(db.String(2), default='M')
     reservations = db.relationship('Reservation', backref='spot', lazy=True, cascade="all, delete-orphan")
 
 class Vehicle(db.Model):
@@ -41,21 +70,117 @@ class Vehicle(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     vehicle_number = db.Column(db.String(20), unique=True, nullable=False)
     vehicle_type = db.Column(db.String(50))
-    created_at = db.Column(db.DateTime, default=lambda: datetime.now(utc))
+    created_at = db.Column(db.DateTime, default=utcnow)
     reservations = db.relationship('Reservation', backref='vehicle', lazy=True)
 
 class Reservation(db.Model):
+    __table_args__ = sharded()
     id = db.Column(db.Integer, primary_key=True)
     spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=True)
-    parking_timestamp = db.Column(db.DateTime, default=lambda: datetime.now(utc))
+    parking_timestamp = db.Column(db.DateTime, default=utcnow)
     leaving_timestamp = db.Column(db.DateTime)
     parking_cost = db.Column(db.Float)
     payment_status = db.Column(db.String(20), default='pending')
     razorpay_order_id = db.Column(db.String(100))
     razorpay_payment_id = db.Column(db.String(100))
 
+class WaitlistEntry(db.Model):
+    __table_args__ = sharded(db.Index('ix_waitlist_queue', 'lot_id', 'status', 'priority', 'id'))
+    id = db.Column(db.Integer, primary_key=True)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
+    priority = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(1), default='W')
+    reservation_id = db.Column(db.Integer, db.ForeignKey('reservation.id'))
+    created_at = db.Column(db.DateTime, default=utcnow)
+    assigned_at = db.Column(db.DateTime)
+    last_polled_at = db.Column(db.DateTime, default=utcnow)
+
+class LotForecast(db.Model):
+    __table_args__ = sharded(autoincrement=False)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), primary_key=True)
+    hour_of_week = db.Column(db.Integer, primary_key=True)
+    occupied_hours = db.Column(db.Float, default=0.0)
+
+class ForecastState(db.Model):
+    __table_args__ = sharded(autoincrement=False)
+    id = db.Column(db.Integer, primary_key=True)
+    last_reservation_id = db.Column(db.Integer, default=0)
+    history_start = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    # Bumped by every refresh; workers reload their cache when it changes.
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class ForecastOpenReservation(db.Model):
+    __table_args__ = sharded(autoincrement=False)
+    # Reservations at or below ForecastState.last_reservation_id that were
+    # still open at the last refresh; they are folded in once closed.
+    reservation_id = db.Column(db.Integer, primary_key=True)
+
+class IdempotencyKey(db.Model):
+    # Kept with the lot the request is about, so the stored response commits
+    # together with the booking.
+    __table_args__ = sharded(autoincrement=False)
+    user_id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    response_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=utcnow, index=True)
+
+class ReplicaHeartbeat(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+# Columns added to existing tables since the first release. create_all()
+# only creates missing tables, so init-db adds these (and any missing
+# indexes) to older databases.
+UPGRADE_COLUMNS = [
+    ('forecast_state', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('user', 'display_timezone', 'VARCHAR(50)'),
+    ('parking_spot', 'floor', 'INTEGER DEFAULT 0'),
+    ('parking_spot', 'zone', 'VARCHAR(10)'),
+    ('parking_spot', 'distance', 'FLOAT DEFAULT 0.0'),
+    ('parking_spot', 'size_class', "VARCHAR(2) DEFAULT 'M'"),
+    ('waitlist_entry', 'last_polled_at', 'DATETIME'),
+]
+
+def upgrade_schema():
+    inspector = db.inspect(db.engine)
+    added = []
+    for table, column, ddl in UPGRADE_COLUMNS:
+        if not inspector.has_table(table):
+            continue
+        if column not in {c['name'] for c in inspector.get_columns(table)}:
+            db.session.execute(db.text(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}'))
+            added.append(f'{table}.{column}')
+    if 'parking_spot.size_class' in added:
+        lay_out_existing_spots()
+    db.session.commit()
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                added.append(index.name)
+    return added
+
+def lay_out_existing_spots():
+    # Spots from before the layout columns are placed on one floor, lot by
+    # lot in id order; spot numbers are kept. They all stay size M (the
+    # column default) until an admin re-sizes the lot.
+    for lot_id, in db.session.query(ParkingLot.id).all():
+        spots = ParkingSpot.query.filter_by(lot_id=lot_id).order_by(ParkingSpot.id).all()
+        for spot, layout in zip(spots, generate_layout('', len(spots))):
+            spot.floor = layout['floor']
+            spot.zone = layout['zone']
+            spot.distance = layout['distance']
+
 def create_admin():
     admin = User.query.filter_by(username='admin').first()
     if not admin:
@@ -72,54 +197,51 @@ def create_admin():
         db.session.commit()
 
 def create_sample_data():
-    from .models import ParkingLot, ParkingSpot
-    if ParkingLot.query.count() == 0:
-        lots_data = [
-            {
-                'name': 'Central Mall',
-                'address': '123 Main Street, City Center',
-                'pin_code': '400001',
-                'price': 50.0,
-                'spots': 20
-            },
-            {
-                'name': 'Airport Terminal',
-                'address': '456 Airport Road, International Airport',
-                'pin_code': '400099',
-                'price': 100.0,
-                'spots': 50
-            },
-            {
-                'name': 'Beach Plaza',
-                'address': '789 Beach Road, Coastal Area',
-                'pin_code': '400005',
-                'price': 30.0,
-                'spots': 15
-            }
-        ]
-        for lot_data in lots_data:
-            lot = ParkingLot(
-                prime_location_name=lot_data['name'],
-                address=lot_data['address'],
-                pin_code=lot_data['pin_code'],
-                price_per_hour=lot_data['price'],
-                maximum_number_of_spots=lot_data['spots']
-            )
-            db.session.add(lot)
-            db.session.commit()
-            for i in range(1, lot_data['spots'] + 1):
-                spot = ParkingSpot(
-                    lot_id=lot.id,
-                    spot_number=f'{lot_data["name"][:1]}{i:02d}',
-                    status='A'
-                )
-                db.session.add(spot)
-        db.session.commit()
+    if db.session.query(ParkingLot.id).first() is not None:
+        return
+    lots_data = [
+        {
+            'name': 'Central Mall',
+            'address': '123 Main Street, City Center',
+            'pin_code': '400001',
+            'price': 50.0,
+            'spots': 20
+        },
+        {
+            'name': 'Airport Terminal',
+            'address': '456 Airport Road, International Airport',
+            'pin_code': '400099',
+            'price': 100.0,
+            'spots': 50,
+            'floors': 2
+        },
+        {
+            'name': 'Beach Plaza',
+            'address': '789 Beach Road, Coastal Area',
+            'pin_code': '400005',
+            'price': 30.0,
+            'spots': 15
+        }
+    ]
+    lots = [
+        ParkingLot(
+            prime_location_name=lot_data['name'],
+            address=lot_data['address'],
+            pin_code=lot_data['pin_code'],
+            price_per_hour=lot_data['price'],
+            maximum_number_of_spots=lot_data['spots']
+        )
+        for lot_data in lots_data
+    ]
+    db.session.add_all(lots)
+    db.session.flush()
+    spots = []
+    for lot, lot_data in zip(lots, lots_data):
+        for spot in generate_layout(lot_data['name'][:1], lot_data['spots'], lot_data.get('floors', 1), sizes=ROW_SIZES):
+            spots.append(dict(spot, lot_id=lot.id, status='A'))
+    db.session.execute(db.insert(ParkingSpot), spots)
+    db.session.commit()
 
 def to_ist_str(dt, fmt='%Y-%m-%d %H:%M'):
-    if not dt:
-        return ''
-    ist = timezone('Asia/Kolkata')
-    if dt.tzinfo is None:
-        dt = utc.localize(dt)
-    return dt.astimezone(ist).strftime(fmt)
\ No newline at end of file
+    from .timefmt import format_local
+    return format_local(dt, fmt)
@@ -0,0 +1,143 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, has_app_context, has_request_context, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from .clock import utcnow
+from .shards import is_sharded, shard_bind
+
+class RoutingSession(Session):
+    # Sharded tables go to the shard in info['shard'] (see models/shards.py).
+    # While the session is marked read-only (see controllers/read_only.py),
+    # primary queries go to a healthy replica bind; flushes, and every query
+    # once the request has written something, use the primary.
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and mapper is not None and self.info.get('shard') and is_sharded(mapper):
+            return shard_bind(self._db, self.info['shard'])
+        if bind is None and self.info.get('read_only') and not self._flushing:
+            replica = choose_replica(self._db)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def commit(self):
+        # Inside an @idempotent view (controllers/idempotency.py) commits only
+        # flush; the wrapper commits once, together with the stored response.
+        if self.info.get('defer_commit'):
+            self.flush()
+            return
+        super().commit()
+
+def replica_keys(db):
+    return sorted(key for key in db.engines if key and key.startswith('replica'))
+
+class ReplicaMonitor:
+    # Replication lag per replica bind, read from a heartbeat row: the
+    # primary's row is bumped by the snapshot-replica job (or by
+    # replica-heartbeat, for replicas fed some other way), and lag is the age
+    # of the replica's copy of it. Checks only read, so read-only requests
+    # never write to the primary. Replicas that are unreachable, lack the row
+    # or lag by more than max_lag seconds are taken out of rotation.
+
+    def __init__(self, max_lag=30, check_interval=5):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._lags = {}
+        self._turn = itertools.count()
+
+    def _ensure_checked(self, db):
+        if self._checked_at is None or time.monotonic() - self._checked_at > self.check_interval:
+            self.check(db)
+
+    def check(self, db):
+        from .models import ReplicaHeartbeat
+        table = ReplicaHeartbeat.__table__
+        now = utcnow()
+        lags = {}
+        for key in replica_keys(db):
+            try:
+                with db.engines[key].connect() as connection:
+                    replica_beat = connection.execute(db.select(table.c.beat_at).where(table.c.id == 1)).scalar()
+            except Exception:
+                replica_beat = None
+            lags[key] = None if replica_beat is None else max((now - replica_beat).total_seconds(), 0.0)
+        with self._lock:
+            self._lags = lags
+            self._checked_at = time.monotonic()
+        return lags
+
+    def lags(self, db):
+        self._ensure_checked(db)
+        with self._lock:
+            return dict(self._lags)
+
+    def healthy(self, db):
+        return [key for key, lag in sorted(self.lags(db).items()) if lag is not None and lag <= self.max_lag]
+
+    def next_replica(self, db):
+        healthy = self.healthy(db)
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+def write_heartbeat(db):
+    from .models import ReplicaHeartbeat
+    table = ReplicaHeartbeat.__table__
+    beat = utcnow()
+    with db.engine.begin() as connection:
+        if not connection.execute(table.update().where(table.c.id == 1).values(beat_at=beat)).rowcount:
+            connection.execute(table.insert().values(id=1, beat_at=beat))
+    return beat
+
+def get_monitor():
+    monitor = current_app.extensions.get('replica_monitor')
+    if monitor is None:
+        monitor = current_app.extensions.setdefault(
+            'replica_monitor',
+            ReplicaMonitor(
+                current_app.config.get('REPLICA_MAX_LAG', 30),
+                current_app.config.get('REPLICA_CHECK_INTERVAL', 5)
+            )
+        )
+    return monitor
+
+def choose_replica(db):
+    if not has_app_context() or not replica_keys(db):
+        return None
+    key = get_monitor().next_replica(db)
+    return db.engines[key] if key else None
+
+def pinned_to_primary():
+    return has_request_context() and http_session.get('primary_until', 0) > time.time()
+
+@contextmanager
+def on_primary(session):
+    # For reads that seed long-lived caches: those are kept current from the
+    # primary's commits, so they must not start from a lagging snapshot.
+    read_only = session.info.pop('read_only', None)
+    try:
+        yield
+    finally:
+        if read_only:
+            session.info['read_only'] = read_only
+
+@event.listens_for(Session, 'after_flush')
+def _route_rest_of_request_to_primary(session, flush_context):
+    session.info.pop('read_only', None)
+    session.info['wrote'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _pin_writer_to_primary(session):
+    # A user who just wrote reads from the primary for a while, so they see
+    # their own booking even if the replicas have not caught up yet.
+    if session.info.pop('wrote', False) and has_request_context() and replica_keys(session._db):
+        http_session['primary_until'] = time.time() + current_app.config.get('REPLICA_PIN_SECONDS', 10)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_writes(session, previous_transaction):
+    session.info.pop('wrote', None)
@@ -0,0 +1,212 @@
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+from pytz import timezone, utc
+from .models import db, ParkingLot, ParkingSpot, Reservation
+from .shards import fan_out
+
+RESERVATION_COLUMNS = ['id', 'spot_id', 'lot_id', 'parking_timestamp', 'leaving_timestamp', 'parking_cost']
+SPOT_COLUMNS = ['id', 'lot_id', 'spot_number', 'lot_name']
+WATERMARK_FILE = '_watermark.json'
+DAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+def _read_watermarks(out_dir):
+    # One watermark per shard: the primary's at the top level (as before
+    # sharding), the other shards' under 'shards'.
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        state = json.load(f)
+    watermarks = {0: state}
+    watermarks.update((int(shard), shard_state) for shard, shard_state in state.get('shards', {}).items())
+    return {
+        shard: {'reservation_id': state.get('reservation_id', 0), 'open_ids': state.get('open_ids', [])}
+        for shard, state in watermarks.items()
+    }
+
+def _write_watermarks(out_dir, watermarks):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    tmp = path + '.tmp'
+    state = dict(watermarks.get(0, {'reservation_id': 0, 'open_ids': []}))
+    others = {str(shard): watermark for shard, watermark in watermarks.items() if shard}
+    if others:
+        state['shards'] = others
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def closed_since(watermark, open_ids, *columns):
+    # Closed reservations not processed yet: everything above the watermark,
+    # plus the ids at or below it that were still open last time. Returns the
+    # rows (joined to their spot), the new watermark and the ids at or below
+    # it that are still open, so one long stay does not hold back the rest.
+    high = max(db.session.query(db.func.max(Reservation.id)).scalar() or 0, watermark)
+    pending = db.or_(
+        db.and_(Reservation.id > watermark, Reservation.id <= high),
+        Reservation.id.in_(open_ids)
+    )
+    # Open ids are read first: a reservation closed in between shows up in
+    # both queries and is then dropped from the open set below.
+    still_open = {
+        reservation_id for reservation_id, in db.session.query(Reservation.id).filter(
+            pending, Reservation.leaving_timestamp == None
+        )
+    }
+    rows = db.session.query(*columns).join(
+        ParkingSpot, Reservation.spot_id == ParkingSpot.id
+    ).filter(
+        pending, Reservation.leaving_timestamp != None
+    ).order_by(Reservation.id).all()
+    still_open.difference_update(row.id for row in rows)
+    return rows, high, sorted(still_open)
+
+def _epoch(dt):
+    if dt.tzinfo is None:
+        dt = utc.localize(dt)
+    return dt.timestamp()
+
+def _export_shard(watermarks, shard):
+    state = watermarks.get(shard, {'reservation_id': 0, 'open_ids': []})
+    rows, watermark, open_ids = closed_since(
+        state['reservation_id'],
+        state['open_ids'],
+        Reservation.id,
+        Reservation.spot_id,
+        ParkingSpot.lot_id,
+        Reservation.parking_timestamp,
+        Reservation.leaving_timestamp,
+        Reservation.parking_cost
+    )
+    spots = db.session.query(
+        ParkingSpot.id, ParkingSpot.lot_id, ParkingSpot.spot_number, ParkingLot.prime_location_name
+    ).join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id).order_by(ParkingSpot.id).all()
+    return [tuple(row) for row in rows], watermark, open_ids, [tuple(spot) for spot in spots]
+
+def _write_segment(out_dir, rows):
+    if not rows:
+        return
+    segment = os.path.join(out_dir, f'reservations_{rows[0][0]:08d}_{rows[-1][0]:08d}.csv')
+    with open(segment, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESERVATION_COLUMNS)
+        for row in rows:
+            reservation_id, spot_id, lot_id, parking_timestamp, leaving_timestamp, parking_cost = row
+            writer.writerow([
+                reservation_id,
+                spot_id,
+                lot_id,
+                _epoch(parking_timestamp),
+                _epoch(leaving_timestamp),
+                parking_cost or 0
+            ])
+
+def export_snapshot(out_dir):
+    # Shards are queried in parallel; each one's new rows go to a segment of
+    # their own, and spots.csv lists the spots of all of them.
+    os.makedirs(out_dir, exist_ok=True)
+    watermarks = _read_watermarks(out_dir)
+    shards = fan_out(db, lambda: _export_shard(watermarks, db.session.info.get('shard', 0)))
+    exported = 0
+    for shard, (rows, watermark, open_ids, _) in enumerate(shards):
+        _write_segment(out_dir, rows)
+        watermarks[shard] = {'reservation_id': watermark, 'open_ids': open_ids}
+        exported += len(rows)
+    _write_watermarks(out_dir, watermarks)
+    with open(os.path.join(out_dir, 'spots.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SPOT_COLUMNS)
+        writer.writerows(spot for _, _, _, spots in shards for spot in spots)
+    return exported
+
+def load_columns(out_dir):
+    columns = {name: [] for name in RESERVATION_COLUMNS}
+    if not os.path.isdir(out_dir):
+        return columns
+    casts = [int, int, int, float, float, float]
+    for name in sorted(os.listdir(out_dir)):
+        if not (name.startswith('reservations_') and name.endswith('.csv')):
+            continue
+        with open(os.path.join(out_dir, name), newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                for column, cast, value in zip(RESERVATION_COLUMNS, casts, row):
+                    columns[column].append(cast(value))
+    return columns
+
+def load_spots(out_dir):
+    path = os.path.join(out_dir, 'spots.csv')
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        return {int(row['id']): row for row in reader}
+
+def utilization_heatmap(columns, tz_name='Asia/Kolkata'):
+    # Occupied spot-hours per (weekday, hour) in local time.
+    tz = timezone(tz_name)
+    grid = [[0.0] * 24 for _ in DAYS]
+    for start, end in zip(columns['parking_timestamp'], columns['leaving_timestamp']):
+        cursor = datetime.fromtimestamp(start, tz)
+        finish = datetime.fromtimestamp(end, tz)
+        while cursor < finish:
+            bucket_end = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            step_end = min(bucket_end, finish)
+            grid[cursor.weekday()][cursor.hour] += (step_end - cursor).total_seconds() / 3600
+            cursor = step_end
+    return grid
+
+def dwell_time_distribution(columns, bins=(0.5, 1, 2, 4, 8, 24)):
+    labels = []
+    lower = 0
+    for upper in bins:
+        labels.append(f'{lower}-{upper}h')
+        lower = upper
+    labels.append(f'{lower}h+')
+    counts = [0] * len(labels)
+    for start, end in zip(columns['parking_timestamp'], columns['leaving_timestamp']):
+        hours = (end - start) / 3600
+        index = len(bins)
+        for i, upper in enumerate(bins):
+            if hours < upper:
+                index = i
+                break
+        counts[index] += 1
+    return list(zip(labels, counts))
+
+def revenue_per_spot(columns, spots=None):
+    totals = {}
+    for spot_id, cost in zip(columns['spot_id'], columns['parking_cost']):
+        totals[spot_id] = totals.get(spot_id, 0) + cost
+    spots = spots or {}
+    result = []
+    for spot_id, revenue in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        spot = spots.get(spot_id, {})
+        result.append({
+            'spot_id': spot_id,
+            'spot_number': spot.get('spot_number', str(spot_id)),
+            'lot_name': spot.get('lot_name', ''),
+            'revenue': round(revenue, 2)
+        })
+    return result
+
+def monthly_revenue(columns):
+    totals = {}
+    for start, cost in zip(columns['parking_timestamp'], columns['parking_cost']):
+        month = datetime.fromtimestamp(start, utc).strftime('%Y-%m')
+        totals[month] = totals.get(month, 0) + cost
+    return [(month, round(totals[month], 2)) for month in sorted(totals)]
+
+def build_report(out_dir):
+    columns = load_columns(out_dir)
+    spots = load_spots(out_dir)
+    return {
+        'reservations': len(columns['id']),
+        'watermark': max((state['reservation_id'] for state in _read_watermarks(out_dir).values()), default=0),
+        'heatmap': utilization_heatmap(columns),
+        'dwell_times': dwell_time_distribution(columns),
+        'revenue_per_spot': revenue_per_spot(columns, spots),
+        'monthly_revenue': monthly_revenue(columns)
+    }
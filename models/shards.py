@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import current_app, request
+
+# Lots live in one of several databases (shards) together with their spots,
+# reservations, waitlist, forecasts and the idempotency keys of requests on
+# them; users and vehicles stay in the primary. Shard 0 is the primary
+# itself and shard k the bind named f'shard{k}'. Ids of the sharded tables
+# are handed out in a range per shard, so a lot, spot, reservation or
+# waitlist entry id also tells which database holds the row.
+SHARD_ID_SPAN = 10 ** 9
+# URL arguments that carry such an id, in the order they are looked at.
+SHARD_ROUTE_ARGS = ('lot_id', 'spot_id', 'reservation_id', 'entry_id')
+
+def shard_keys(db):
+    return sorted((key for key in db.engines if key and key.startswith('shard')), key=lambda key: int(key[5:]))
+
+def shard_count(db):
+    return 1 + len(shard_keys(db))
+
+def shard_of(row_id):
+    return int(row_id) // SHARD_ID_SPAN
+
+def shard_bind(db, shard):
+    return db.engines[f'shard{shard}'] if shard else db.engine
+
+def is_sharded(mapper):
+    table = getattr(mapper, 'persist_selectable', None)
+    if table is None:
+        table = getattr(mapper, '__table__', None)
+    return table is not None and table.info.get('sharded', False)
+
+def sharded_tables(db):
+    return [table for table in db.metadata.sorted_tables if table.info.get('sharded')]
+
+def check_shards(db):
+    keys = shard_keys(db)
+    expected = [f'shard{k}' for k in range(1, len(keys) + 1)]
+    if keys != expected:
+        raise ValueError(f'Shard binds must be named {", ".join(expected)}; got {", ".join(keys)}')
+
+def create_shard_tables(db):
+    # create_all() only fills the primary: each shard gets the sharded tables,
+    # with its id sequences started at the bottom of its range.
+    tables = sharded_tables(db)
+    for shard in range(1, shard_count(db)):
+        engine = shard_bind(db, shard)
+        db.metadata.create_all(engine, tables=tables)
+        if engine.dialect.name != 'sqlite':
+            continue
+        with engine.begin() as connection:
+            for table in tables:
+                if table.dialect_options['sqlite']['autoincrement']:
+                    connection.exec_driver_sql(
+                        'INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? '
+                        'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)',
+                        (table.name, shard * SHARD_ID_SPAN, table.name)
+                    )
+
+def route_request_to_shard():
+    # before_request hook: a request about a lot, spot, reservation or
+    # waitlist entry runs on the shard that holds it.
+    from .models import db
+    db.session.info.pop('shard', None)
+    for name in SHARD_ROUTE_ARGS:
+        if name in (request.view_args or {}):
+            shard = shard_of(request.view_args[name])
+            if 0 < shard < shard_count(db):
+                db.session.info['shard'] = shard
+            return
+
+@contextmanager
+def on_shard(session, shard):
+    previous = session.info.get('shard')
+    session.info['shard'] = shard
+    try:
+        yield
+    finally:
+        if previous is None:
+            session.info.pop('shard', None)
+        else:
+            session.info['shard'] = previous
+
+def fan_out(db, fn):
+    # Runs fn() once per shard with the session pointed at that shard and
+    # returns the results in shard order. With more than one shard the calls
+    # run in parallel, each in its own app context and session, so fn must
+    # take what it needs from its closure (not from the request) and return
+    # loaded data rather than lean on lazy loads afterwards.
+    count = shard_count(db)
+    if count == 1:
+        with on_shard(db.session, 0):
+            return [fn()]
+    app = current_app._get_current_object()
+    read_only = db.session.info.get('read_only')
+
+    def run(shard):
+        with app.app_context():
+            db.session.info['shard'] = shard
+            if read_only:
+                db.session.info['read_only'] = read_only
+            try:
+                return fn()
+            finally:
+                db.session.remove()
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(run, range(count)))
+
+def fan_out_rows(db, fn):
+    return [row for rows in fan_out(db, fn) for row in rows]
@@ -0,0 +1,170 @@
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from .models import db, User, ParkingLot, ParkingSpot, Reservation
+from .replicas import on_primary
+from .shards import fan_out
+
+_TRACKED = (User, ParkingLot, ParkingSpot, Reservation)
+
+def _count_shard():
+    lots = db.session.query(db.func.count(ParkingLot.id)).scalar()
+    reservations = db.session.query(db.func.count(Reservation.id)).scalar()
+    spot_rows = db.session.query(
+        ParkingSpot.lot_id,
+        db.func.count(ParkingSpot.id),
+        db.func.sum(db.case((ParkingSpot.status == 'O', 1), else_=0))
+    ).group_by(ParkingSpot.lot_id).all()
+    return lots, reservations, [tuple(row) for row in spot_rows]
+
+class StatsCounters:
+    # Global and per-lot counters for the admin pages. Kept current from this
+    # process's commits; a full recount runs after max_age seconds (to pick up
+    # other workers' writes) and after any bulk statement on a counted table.
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._lots = 0
+        self._users = 0
+        self._reservations = 0
+        self._spots = {}
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age:
+            self.recount()
+
+    def recount(self):
+        with on_primary(db.session):
+            users = db.session.query(db.func.count(User.id)).filter(User.is_admin == False).scalar()
+            shards = fan_out(db, _count_shard)
+        with self._lock:
+            self._lots = sum(lots for lots, _, _ in shards)
+            self._users = users
+            self._reservations = sum(reservations for _, reservations, _ in shards)
+            self._spots = {
+                lot_id: [total, occupied or 0]
+                for _, _, spot_rows in shards for lot_id, total, occupied in spot_rows
+            }
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def apply(self, changes):
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._lots += changes['lots']
+            self._users += changes['users']
+            self._reservations += changes['reservations']
+            for lot_id, (total, occupied) in changes['spots'].items():
+                counts = self._spots.setdefault(lot_id, [0, 0])
+                counts[0] += total
+                counts[1] += occupied
+
+    def totals(self):
+        self._ensure_loaded()
+        with self._lock:
+            total_spots = sum(counts[0] for counts in self._spots.values())
+            occupied_spots = sum(counts[1] for counts in self._spots.values())
+            return {
+                'total_lots': self._lots,
+                'total_spots': total_spots,
+                'occupied_spots': occupied_spots,
+                'available_spots': total_spots - occupied_spots,
+                'total_users': self._users,
+                'total_reservations': self._reservations
+            }
+
+    def lot(self, lot_id):
+        self._ensure_loaded()
+        with self._lock:
+            total, occupied = self._spots.get(lot_id, (0, 0))
+        return {'total_spots': total, 'occupied_spots': occupied, 'available_spots': total - occupied}
+
+def get_stats():
+    stats = current_app.extensions.get('stats')
+    if stats is None:
+        stats = current_app.extensions.setdefault(
+            'stats',
+            StatsCounters(current_app.config.get('STATS_MAX_AGE', 60))
+        )
+    return stats
+
+def _pending(session):
+    return session.info.setdefault('stats_changes', {
+        'lots': 0, 'users': 0, 'reservations': 0, 'spots': {}, 'invalidate': False
+    })
+
+def _old_value(obj, attr):
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+def _count_spot(pending, lot_id, total, occupied):
+    counts = pending['spots'].setdefault(lot_id, [0, 0])
+    counts[0] += total
+    counts[1] += occupied
+
+@event.listens_for(Session, 'after_flush')
+def _track_stats_changes(session, flush_context):
+    pending = _pending(session)
+    for obj in session.new:
+        if isinstance(obj, ParkingSpot):
+            _count_spot(pending, obj.lot_id, 1, obj.status == 'O')
+        elif isinstance(obj, ParkingLot):
+            pending['lots'] += 1
+        elif isinstance(obj, Reservation):
+            pending['reservations'] += 1
+        elif isinstance(obj, User) and not obj.is_admin:
+            pending['users'] += 1
+    for obj in session.dirty:
+        if isinstance(obj, ParkingSpot):
+            was_occupied = _old_value(obj, 'status') == 'O'
+            old_lot = _old_value(obj, 'lot_id')
+            if old_lot != obj.lot_id or was_occupied != (obj.status == 'O'):
+                _count_spot(pending, old_lot, -1, -was_occupied)
+                _count_spot(pending, obj.lot_id, 1, obj.status == 'O')
+        elif isinstance(obj, User):
+            was_admin = bool(_old_value(obj, 'is_admin'))
+            if was_admin != bool(obj.is_admin):
+                pending['users'] += 1 if was_admin else -1
+    for obj in session.deleted:
+        if isinstance(obj, ParkingSpot):
+            _count_spot(pending, _old_value(obj, 'lot_id'), -1, -(_old_value(obj, 'status') == 'O'))
+        elif isinstance(obj, ParkingLot):
+            pending['lots'] -= 1
+        elif isinstance(obj, Reservation):
+            pending['reservations'] -= 1
+        elif isinstance(obj, User) and not _old_value(obj, 'is_admin'):
+            pending['users'] -= 1
+
+@event.listens_for(Session, 'do_orm_execute')
+def _track_bulk_statements(orm_execute_state):
+    # Bulk INSERT/UPDATE/DELETE skips the unit of work, so the counters
+    # cannot be adjusted row by row; recount after the commit instead.
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and issubclass(mapper.class_, _TRACKED):
+        _pending(orm_execute_state.session)['invalidate'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _apply_stats_changes(session):
+    pending = session.info.pop('stats_changes', None)
+    if pending and has_app_context():
+        stats = get_stats()
+        if pending['invalidate']:
+            stats.invalidate()
+        else:
+            stats.apply(pending)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_stats_changes(session, previous_transaction):
+    session.info.pop('stats_changes', None)
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+DEFAULT_TZ = 'Asia/Kolkata'
+DISPLAY_TIMEZONES = [
+    'Asia/Kolkata',
+    'Asia/Dubai',
+    'Asia/Singapore',
+    'Europe/London',
+    'America/New_York',
+    'UTC'
+]
+
+@lru_cache(maxsize=None)
+def get_tz(name):
+    from pytz import timezone
+    return timezone(name)
+
+@lru_cache(maxsize=65536)
+def _utc_offset(tz_name, utc_time):
+    from pytz import utc
+    return utc.localize(utc_time).astimezone(get_tz(tz_name)).utcoffset()
+
+@lru_cache(maxsize=65536)
+def _day_offset(tz_name, day):
+    # One offset per (zone, UTC day) when it is the same at both ends of the
+    # day, which is every day except DST switch-overs; those return None and
+    # fall back to an exact per-timestamp lookup.
+    start = datetime(day.year, day.month, day.day)
+    offset = _utc_offset(tz_name, start)
+    if _utc_offset(tz_name, start + timedelta(days=1) - timedelta(microseconds=1)) != offset:
+        return None
+    return offset
+
+def to_local(dt, tz_name=DEFAULT_TZ):
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(dt_timezone.utc).replace(tzinfo=None)
+    offset = _day_offset(tz_name, dt.date())
+    if offset is None:
+        offset = _utc_offset(tz_name, dt)
+    return dt + offset
+
+def format_local(dt, fmt='%Y-%m-%d %H:%M', tz_name=DEFAULT_TZ):
+    if not dt:
+        return ''
+    return to_local(dt, tz_name or DEFAULT_TZ).strftime(fmt)
+
+def format_many(dts, fmt='%Y-%m-%d %H:%M', tz_name=DEFAULT_TZ):
+    tz_name = tz_name or DEFAULT_TZ
+    return [to_local(dt, tz_name).strftime(fmt) if dt else '' for dt in dts]
@@ -0,0 +1,207 @@
+import re
+import threading
+import time
+from collections import namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from .models import db, Vehicle
+from .replicas import on_primary
+
+VehicleEntry = namedtuple('VehicleEntry', ['id', 'user_id', 'vehicle_number', 'vehicle_type'])
+
+def normalize_plate(plate):
+    return re.sub(r'[^A-Z0-9]', '', (plate or '').upper())
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class VehicleRegistry:
+    # Per-process view of the vehicle table: plate -> vehicle, user -> vehicles,
+    # plus a sorted plate list and trigram index for partial plate search.
+    # Mutations from this process are applied on commit; after max_age seconds
+    # a background thread reloads everything to pick up writes from other
+    # workers, while requests keep using the previous copy.
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._loaded_at = None
+        self._missed = None
+        self._vehicles = {}
+        self._by_plate = {}
+        self._by_user = {}
+        self._trigrams = {}
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            # Only the first load blocks, and only one request runs it.
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self.reload()
+        elif time.monotonic() - self._loaded_at > self.max_age:
+            self._reload_in_background()
+
+    def _reload_in_background(self):
+        if not self._reload_lock.acquire(blocking=False):
+            return
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.reload()
+                    db.session.remove()
+            finally:
+                self._reload_lock.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def reload(self):
+        # Commits applied while the table is being read are replayed on top
+        # of the new copy, so they are not lost if the read missed them.
+        with self._lock:
+            self._missed = []
+        try:
+            with on_primary(db.session):
+                rows = db.session.query(Vehicle.id, Vehicle.user_id, Vehicle.vehicle_number, Vehicle.vehicle_type).all()
+        except Exception:
+            with self._lock:
+                self._missed = None
+            raise
+        with self._lock:
+            self._vehicles = {}
+            self._by_plate = {}
+            self._by_user = {}
+            self._trigrams = {}
+            for row in rows:
+                self._add(VehicleEntry(*row))
+            missed, self._missed = self._missed, None
+            self._loaded_at = time.monotonic()
+        for upserts, deletes in missed:
+            self.apply(upserts, deletes)
+
+    def _add(self, entry):
+        plate = normalize_plate(entry.vehicle_number)
+        self._vehicles[entry.id] = entry
+        self._by_plate[plate] = entry.id
+        self._by_user.setdefault(entry.user_id, []).append(entry.id)
+        for gram in _trigrams(plate):
+            self._trigrams.setdefault(gram, set()).add(entry.id)
+
+    def _remove(self, vehicle_id):
+        entry = self._vehicles.pop(vehicle_id, None)
+        if not entry:
+            return
+        plate = normalize_plate(entry.vehicle_number)
+        if self._by_plate.get(plate) == vehicle_id:
+            del self._by_plate[plate]
+        user_vehicles = self._by_user.get(entry.user_id, [])
+        if vehicle_id in user_vehicles:
+            user_vehicles.remove(vehicle_id)
+        for gram in _trigrams(plate):
+            ids = self._trigrams.get(gram)
+            if ids:
+                ids.discard(vehicle_id)
+
+    def apply(self, upserts, deletes):
+        upserts = list(upserts)
+        with self._lock:
+            if self._missed is not None:
+                self._missed.append((upserts, deletes))
+            if self._loaded_at is None:
+                return
+            for vehicle_id in deletes:
+                self._remove(vehicle_id)
+            for entry in upserts:
+                self._remove(entry.id)
+                self._add(entry)
+
+    def get(self, vehicle_id):
+        self._ensure_loaded()
+        entry = self._vehicles.get(vehicle_id)
+        if entry is None:
+            vehicle = db.session.get(Vehicle, vehicle_id)
+            if vehicle:
+                entry = VehicleEntry(vehicle.id, vehicle.user_id, vehicle.vehicle_number, vehicle.vehicle_type)
+                self.apply([entry], [])
+        return entry
+
+    def owned_by(self, vehicle_id, user_id):
+        try:
+            vehicle_id = int(vehicle_id)
+        except (TypeError, ValueError):
+            return False
+        entry = self.get(vehicle_id)
+        return entry is not None and entry.user_id == user_id
+
+    def plate_taken(self, plate, exclude_id=None):
+        # A hit is authoritative; a miss may be a plate registered by another
+        # worker since the last reload, which the unique constraint still catches.
+        self._ensure_loaded()
+        vehicle_id = self._by_plate.get(normalize_plate(plate))
+        return vehicle_id is not None and vehicle_id != exclude_id
+
+    def user_vehicles(self, user_id):
+        self._ensure_loaded()
+        with self._lock:
+            return [self._vehicles[i] for i in sorted(self._by_user.get(user_id, []))]
+
+    def search(self, term, limit=None):
+        self._ensure_loaded()
+        term = normalize_plate(term)
+        if not term:
+            return []
+        with self._lock:
+            if len(term) < 3:
+                # Too short for trigrams: a substring scan over the plates.
+                candidates = self._by_plate.items()
+            else:
+                # Walks the rarest trigram's ids lazily, checking the others
+                # per id, so no candidate set is built or copied.
+                postings = sorted((self._trigrams.get(gram, ()) for gram in _trigrams(term)), key=len)
+                rarest, others = postings[0], postings[1:]
+                candidates = (
+                    (normalize_plate(self._vehicles[i].vehicle_number), i)
+                    for i in rarest if all(i in ids for ids in others)
+                )
+            # Stops at limit before sorting, so a common term costs O(limit)
+            # rather than a sort of every candidate.
+            matches = []
+            for plate, vehicle_id in candidates:
+                if term in plate:
+                    matches.append(vehicle_id)
+                    if limit and len(matches) >= limit:
+                        break
+            return sorted(matches)
+
+def get_registry():
+    registry = current_app.extensions.get('vehicle_registry')
+    if registry is None:
+        registry = current_app.extensions.setdefault(
+            'vehicle_registry',
+            VehicleRegistry(current_app.config.get('VEHICLE_REGISTRY_MAX_AGE', 300))
+        )
+    return registry
+
+@event.listens_for(Session, 'after_flush')
+def _track_vehicle_changes(session, flush_context):
+    pending = session.info.setdefault('vehicle_changes', {'upserts': {}, 'deletes': set()})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Vehicle):
+            pending['upserts'][obj.id] = VehicleEntry(obj.id, obj.user_id, obj.vehicle_number, obj.vehicle_type)
+    for obj in session.deleted:
+        if isinstance(obj, Vehicle):
+            pending['upserts'].pop(obj.id, None)
+            pending['deletes'].add(obj.id)
+
+@event.listens_for(Session, 'after_commit')
+def _apply_vehicle_changes(session):
+    pending = session.info.pop('vehicle_changes', None)
+    if pending and has_app_context():
+        get_registry().apply(pending['upserts'].values(), pending['deletes'])
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_vehicle_changes(session, previous_transaction):
+    session.info.pop('vehicle_changes', None)
@@ -0,0 +1,156 @@
+import threading
+import time
+from datetime import timedelta
+from flask import current_app
+from .models import db, ParkingLot, ParkingSpot, Reservation, WaitlistEntry
+from .clock import utcnow
+from .layout import DEFAULT_SIZE
+from .allocator import get_allocator
+from .vehicle_registry import get_registry
+from .shards import fan_out
+
+# Entry status: W = waiting, S = served (spot assigned), C = cancelled,
+# E = expired (its client stopped polling).
+_assigned = threading.Condition()
+
+def queue_order():
+    return (WaitlistEntry.priority.desc(), WaitlistEntry.id)
+
+def _polled_since():
+    # Waiting entries count only while their client keeps polling; the page
+    # long-polls for 25 seconds at a time, so this is several missed polls.
+    cutoff = utcnow() - timedelta(seconds=current_app.config.get('WAITLIST_ENTRY_TTL', 120))
+    return db.func.coalesce(WaitlistEntry.last_polled_at, WaitlistEntry.created_at) >= cutoff
+
+def waiting_entries(lot_id):
+    return WaitlistEntry.query.filter(
+        WaitlistEntry.lot_id == lot_id,
+        WaitlistEntry.status == 'W',
+        _polled_since()
+    ).order_by(*queue_order()).all()
+
+def expire_stale(lot_id):
+    return WaitlistEntry.query.filter(
+        WaitlistEntry.lot_id == lot_id,
+        WaitlistEntry.status == 'W',
+        ~_polled_since()
+    ).update({'status': 'E'}, synchronize_session=False)
+
+def touch(entry):
+    WaitlistEntry.query.filter_by(id=entry.id, status='W').update(
+        {'last_polled_at': utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+
+def position(entry):
+    if entry.status != 'W':
+        return 0
+    ahead = WaitlistEntry.query.filter(
+        WaitlistEntry.lot_id == entry.lot_id,
+        WaitlistEntry.status == 'W',
+        _polled_since(),
+        (WaitlistEntry.priority > entry.priority) |
+        ((WaitlistEntry.priority == entry.priority) & (WaitlistEntry.id < entry.id))
+    ).count()
+    return ahead + 1
+
+def join(lot_id, user_id, vehicle_id, priority=0):
+    entry = WaitlistEntry.query.filter_by(lot_id=lot_id, user_id=user_id, status='W').first()
+    if entry:
+        touch(entry)
+        return entry, False
+    entry = WaitlistEntry(lot_id=lot_id, user_id=user_id, vehicle_id=vehicle_id, priority=priority)
+    db.session.add(entry)
+    db.session.commit()
+    return entry, True
+
+def assign_next(spot):
+    # Hands a just-freed spot to the head of the lot's queue inside the
+    # caller's transaction; the caller commits. Returns the new reservation.
+    registry = get_registry()
+    allocator = get_allocator()
+    size_class = spot.size_class or DEFAULT_SIZE
+    expire_stale(spot.lot_id)
+    while True:
+        # The first waiter whose vehicle fits the spot and is not parked
+        # already; a bike spot does not hold up the queue for a car at its head.
+        entry = next((
+            entry for entry in waiting_entries(spot.lot_id)
+            if size_class in allocator.sizes_for(spot.lot_id, getattr(registry.get(entry.vehicle_id), 'vehicle_type', None))
+            and not _is_parked(entry.vehicle_id)
+        ), None)
+        if not entry:
+            return None
+        # Claim with a conditional update so two concurrent releases cannot
+        # hand spots to the same waiter.
+        claimed = WaitlistEntry.query.filter_by(id=entry.id, status='W').update(
+            {'status': 'S', 'assigned_at': utcnow()}, synchronize_session=False
+        )
+        if claimed:
+            break
+    db.session.refresh(entry)
+    lot = db.session.get(ParkingLot, spot.lot_id)
+    reservation = Reservation(
+        spot_id=spot.id,
+        user_id=entry.user_id,
+        vehicle_id=entry.vehicle_id,
+        parking_cost=lot.price_per_hour
+    )
+    db.session.add(reservation)
+    db.session.flush()
+    spot.status = 'O'
+    entry.reservation_id = reservation.id
+    return reservation
+
+def _is_parked(vehicle_id):
+    # The vehicle may be parked in a lot on any shard.
+    return any(fan_out(
+        db, lambda: Reservation.query.filter_by(vehicle_id=vehicle_id, leaving_timestamp=None).first() is not None
+    ))
+
+def notify_assigned():
+    with _assigned:
+        _assigned.notify_all()
+
+def waiter_slots():
+    # Each long-poll holds a worker thread that bookings also need for its
+    # whole wait, so only this many wait at once per process; the rest
+    # answer straight away.
+    slots = current_app.extensions.get('waitlist_waiters')
+    if slots is None:
+        slots = current_app.extensions.setdefault(
+            'waitlist_waiters',
+            threading.BoundedSemaphore(current_app.config.get('WAITLIST_MAX_WAITERS', 16))
+        )
+    return slots
+
+def wait_for_assignment(entry_id, timeout, poll_interval=1.0):
+    # Long-poll: woken straight away by assignments made in this process,
+    # and re-reads the entry every poll_interval to see other workers' writes.
+    deadline = time.monotonic() + timeout
+    while True:
+        # End the previous read transaction so each check sees a fresh snapshot.
+        db.session.rollback()
+        entry = db.session.get(WaitlistEntry, entry_id)
+        remaining = deadline - time.monotonic()
+        if entry is None or entry.status != 'W' or remaining <= 0:
+            return entry
+        # Hand the connection back to the pool for the wait.
+        db.session.rollback()
+        with _assigned:
+            _assigned.wait(min(poll_interval, remaining))
+
+def entry_payload(entry):
+    payload = {
+        'entry_id': entry.id,
+        'lot_id': entry.lot_id,
+        'status': {'W': 'waiting', 'S': 'assigned', 'C': 'cancelled', 'E': 'expired'}[entry.status],
+        'position': position(entry)
+    }
+    # The reservation is gone if the lot was deleted since.
+    reservation = entry.reservation_id and db.session.get(Reservation, entry.reservation_id)
+    spot = reservation and db.session.get(ParkingSpot, reservation.spot_id)
+    if spot:
+        payload['reservation_id'] = reservation.id
+        payload['spot_number'] = spot.spot_number
+    return payload
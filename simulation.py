@@ -0,0 +1,240 @@
+import argparse
+import heapq
+import os
+import random
+import re
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import event
+
+from app import create_app
+from models.models import db, create_admin, User, Vehicle, ParkingLot, ParkingSpot
+from models.layout import ROW_SIZES, generate_layout
+from models.clock import SimulatedClock, install_clock
+
+# Run with: python simulation.py --users 2000 --spots 400 --floors 3 --hours 48
+# Discrete-event capacity simulation for a planned lot: simulated users
+# browse, book and release through the real controllers while a simulated
+# clock jumps from event to event, so a day of traffic takes seconds.
+
+START = datetime(2025, 1, 6)
+VEHICLE_MIX = ['Car'] * 7 + ['Bike', 'SUV', 'Van']
+# Relative arrival rate for each hour of the day (UTC), peaking at the
+# morning and evening rush.
+HOURLY_DEMAND = [1, 1, 1, 1, 2, 4, 7, 10, 10, 8, 6, 6, 7, 6, 6, 7, 9, 10, 9, 6, 4, 3, 2, 1]
+REPORT_INTERVAL = timedelta(minutes=15)
+
+class QueryProfile:
+    # Statement count and time per (verb, table), to show where the
+    # database spends its time under the simulated load.
+
+    def __init__(self, engine):
+        self.stats = defaultdict(lambda: [0, 0.0])
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        verb = statement.split(None, 1)[0].upper()
+        table = re.search(r'\b(?:FROM|INTO|UPDATE)\s+"?(\w+)', statement, re.IGNORECASE)
+        entry = self.stats[(verb, table.group(1) if table else '-')]
+        entry[0] += 1
+        entry[1] += elapsed
+
+    def hot_spots(self, limit=8):
+        return sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+
+class Simulation:
+    def __init__(self, users=1000, spots=200, floors=2, hours=24, visits_per_day=1.0,
+                 mean_stay_hours=2.0, browse_ratio=0.5, seed=1):
+        self.users = users
+        self.spots = spots
+        self.floors = floors
+        self.horizon = START + timedelta(hours=hours)
+        self.visits_per_day = visits_per_day
+        self.mean_stay = timedelta(hours=mean_stay_hours)
+        self.browse_ratio = browse_ratio
+        self.rng = random.Random(seed)
+        self.clock = SimulatedClock(START)
+        self.events = []
+        self.sequence = 0
+        self.clients = {}
+        self.parked = {}
+        self.latencies = defaultdict(list)
+        self.counts = defaultdict(int)
+        self.rejected_by_type = defaultdict(int)
+        self.occupancy = []
+
+    def setup(self, path):
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+            'EVENT_LOG_DIR': None,
+            'SECRET_KEY': 'simulation'
+        })
+        install_clock(self.app, self.clock)
+        with self.app.app_context():
+            db.create_all()
+            create_admin()
+            lot = ParkingLot(prime_location_name='Planned', address='-', pin_code='000000',
+                price_per_hour=50.0, maximum_number_of_spots=self.spots)
+            db.session.add(lot)
+            db.session.flush()
+            db.session.add_all(
+                ParkingSpot(lot_id=lot.id, status='A', **spot)
+                for spot in generate_layout('P', self.spots, self.floors, sizes=ROW_SIZES)
+            )
+            users = [
+                User(username=f'sim{i}', email=f'sim{i}@sim.test', password_hash='-')
+                for i in range(self.users)
+            ]
+            db.session.add_all(users)
+            db.session.flush()
+            vehicles = [
+                Vehicle(user_id=user.id, vehicle_number=f'SIM{i:06d}', vehicle_type=self.rng.choice(VEHICLE_MIX))
+                for i, user in enumerate(users)
+            ]
+            db.session.add_all(vehicles)
+            db.session.commit()
+            self.lot_id = lot.id
+            self.people = [(user.id, vehicle.id, vehicle.vehicle_type) for user, vehicle in zip(users, vehicles)]
+            self.admin_id = User.query.filter_by(username='admin').first().id
+            self.profile = QueryProfile(db.engine)
+
+    def schedule(self, at, kind, person=None):
+        self.sequence += 1
+        heapq.heappush(self.events, (at, self.sequence, kind, person))
+
+    def next_arrival(self, after):
+        # Thinned Poisson process following HOURLY_DEMAND.
+        peak = max(HOURLY_DEMAND)
+        rate = self.visits_per_day * peak / (sum(HOURLY_DEMAND) / 24) / 24
+        at = after
+        while True:
+            at += timedelta(hours=self.rng.expovariate(rate))
+            if self.rng.random() * peak < HOURLY_DEMAND[at.hour]:
+                return at
+
+    def client(self, user_id, is_admin=False):
+        client = self.clients.get(user_id)
+        if client is None:
+            client = self.clients[user_id] = self.app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = user_id
+                sess['is_admin'] = is_admin
+        return client
+
+    def request(self, name, client, method, url, **kwargs):
+        start = time.perf_counter()
+        response = getattr(client, method)(url, **kwargs)
+        self.latencies[name].append(time.perf_counter() - start)
+        self.counts['requests'] += 1
+        return response
+
+    def arrive(self, person):
+        user_id, vehicle_id, vehicle_type = self.people[person]
+        client = self.client(user_id)
+        if self.rng.random() < self.browse_ratio:
+            self.request('dashboard', client, 'get', '/dashboard')
+            self.request('view_lot', client, 'get', f'/lot/{self.lot_id}')
+        booked = self.request('book_lot', client, 'post', f'/book_lot/{self.lot_id}', json={'vehicle_id': vehicle_id}).get_json()
+        if booked.get('success'):
+            self.counts['bookings'] += 1
+            self.parked[person] = booked['reservation_id']
+            stay = timedelta(hours=self.rng.expovariate(1 / (self.mean_stay.total_seconds() / 3600)))
+            self.schedule(self.clock.now() + max(stay, timedelta(minutes=10)), 'depart', person)
+        else:
+            self.counts['rejected'] += 1
+            self.rejected_by_type[vehicle_type] += 1
+            self.schedule(self.next_arrival(self.clock.now()), 'arrive', person)
+
+    def depart(self, person):
+        user_id = self.people[person][0]
+        reservation_id = self.parked.pop(person)
+        released = self.request('release_spot', self.client(user_id), 'post', f'/release_spot/{reservation_id}').get_json()
+        if released.get('success'):
+            self.counts['releases'] += 1
+        self.schedule(self.next_arrival(self.clock.now()), 'arrive', person)
+
+    def report(self):
+        admin = self.client(self.admin_id, is_admin=True)
+        self.request('admin_dashboard', admin, 'get', '/admin/dashboard')
+        self.request('admin_summary', admin, 'get', '/admin/summary')
+        self.schedule(self.clock.now() + REPORT_INTERVAL, 'report')
+
+    def sample(self):
+        self.occupancy.append((self.clock.now(), len(self.parked)))
+        self.schedule(self.clock.now() + timedelta(hours=1), 'sample')
+
+    def run(self):
+        for person in range(self.users):
+            self.schedule(self.next_arrival(START), 'arrive', person)
+        self.schedule(START, 'report')
+        self.schedule(START, 'sample')
+        handlers = {'arrive': self.arrive, 'depart': self.depart, 'report': self.report, 'sample': self.sample}
+        started = time.perf_counter()
+        with self.app.app_context():
+            while self.events and self.events[0][0] < self.horizon:
+                at, _, kind, person = heapq.heappop(self.events)
+                self.clock.set(at)
+                self.counts['events'] += 1
+                if person is None:
+                    handlers[kind]()
+                else:
+                    handlers[kind](person)
+        self.wall_seconds = time.perf_counter() - started
+        return self
+
+    def summary(self):
+        simulated = (self.horizon - START).total_seconds()
+        attempts = self.counts['bookings'] + self.counts['rejected']
+        lines = [
+            f'Simulated {simulated / 3600:.0f}h: {self.users} users, {self.spots} spots on {self.floors} floor(s), '
+            f'{self.wall_seconds:.1f}s wall ({simulated / max(self.wall_seconds, 1e-9):.0f}x real time)',
+            f'Throughput: {self.counts["requests"]} requests, {self.counts["requests"] / max(self.wall_seconds, 1e-9):.0f} req/s',
+            f'Bookings: {self.counts["bookings"]} ok, {self.counts["rejected"]} rejected '
+            f'({self.counts["rejected"] / max(attempts, 1):.1%}), {self.counts["releases"]} releases',
+            'Rejected by vehicle type: ' + (', '.join(
+                f'{vehicle_type} {count}' for vehicle_type, count in sorted(self.rejected_by_type.items())
+            ) or 'none'),
+            '',
+            f'{"endpoint":>16} {"count":>7} {"p50 ms":>8} {"p95 ms":>8}'
+        ]
+        for name, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            lines.append(f'{name:>16} {len(samples):7d} {samples[len(samples) // 2] * 1000:8.1f} '
+                         f'{samples[int(len(samples) * 0.95)] * 1000:8.1f}')
+        lines += ['', 'Occupancy (UTC hour, spots in use):']
+        for at, occupied in self.occupancy:
+            share = occupied / self.spots
+            lines.append(f'  {at:%a %H:%M} {occupied:6d} {share:5.0%} {"#" * int(share * 40)}')
+        lines += ['', f'DB hot spots {"statements":>24} {"total ms":>9} {"mean ms":>8}']
+        for (verb, table), (count, elapsed) in self.profile.hot_spots():
+            lines.append(f'  {verb:>6} {table:<22} {count:8d} {elapsed * 1000:9.1f} {elapsed / count * 1000:8.3f}')
+        return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description='Capacity simulation for a planned parking lot')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--spots', type=int, default=200)
+    parser.add_argument('--floors', type=int, default=2)
+    parser.add_argument('--hours', type=int, default=24)
+    parser.add_argument('--visits-per-day', type=float, default=1.0)
+    parser.add_argument('--mean-stay-hours', type=float, default=2.0)
+    parser.add_argument('--browse-ratio', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    simulation = Simulation(args.users, args.spots, args.floors, args.hours, args.visits_per_day,
+        args.mean_stay_hours, args.browse_ratio, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        simulation.setup(os.path.join(tmp, 'simulation.db'))
+        print(simulation.run().summary())
+        with simulation.app.app_context():
+            db.engine.dispose()
+
+if __name__ == '__main__':
+    main()
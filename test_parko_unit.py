@@ -1,9 +1,33 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from flask import Flask
 from werkzeug.security import generate_password_hash
-from models.models import db, User, ParkingLot, ParkingSpot, Reservation, Vehicle 
+from models.models import db, User, ParkingLot, ParkingSpot, Reservation, Vehicle, WaitlistEntry, IdempotencyKey, upgrade_schema, create_sample_data
+from models.reports import export_snapshot, build_report
+from models.forecast import refresh_forecasts, expected_free, hour_of_week, ForecastCache
+from controllers.parking_controller import parking_bp
+from models.vehicle_registry import get_registry, normalize_plate
+from models.event_log import ReservationEventLog, replay_events, open_event_log, commit_logged
+from benchmarks.startup import measure as measure_startup
+from models.timefmt import format_local, format_many
+from models.stats import get_stats
+from models.layout import generate_layout
+from models.waitlist import assign_next, entry_payload
+from models.allocator import LotAllocator
+from models.replicas import get_monitor
+from models.shards import SHARD_ID_SPAN, create_shard_tables, on_shard
+from models.clock import SimulatedClock, install_clock, utcnow
+from app import create_app
+from simulation import Simulation
+from sqlalchemy import create_engine, event
+
+# Compared against the median of several fresh-interpreter runs.
+STARTUP_BUDGET_SECONDS = 1.5
 
 def create_initial_data(app):
     with app.app_context():
@@ -125,39 +149,48 @@ class TestParkoBusinessLogic(unittest.TestCase):
             print("test_3_book_occupied_spot_fails_condition passed")
 
     # UNIT 4: Releasing a Spot & Cost Calculation
-    @patch('controllers.parking_controller.datetime')
-    def test_4_release_spot_one_hour_cost(self, mock_datetime):
-        with self.app.app_context():
-            mock_datetime.utcnow.return_value = datetime(2025, 11, 10, 11, 0, 0)
+    def test_4_release_spot_one_hour_cost(self):
+        install_clock(self.app, SimulatedClock(datetime(2025, 11, 10, 11, 0, 0)))
+        self.app.register_blueprint(parking_bp)
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
 
-            reservation = self.res1
-            reservation.leaving_timestamp = mock_datetime.utcnow()
-            duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600 
-            total_cost = round(duration * reservation.parking_cost, 2)
-            reservation.parking_cost = total_cost
-            spot = db.session.get(ParkingSpot, reservation.spot_id)
-            spot.status = 'A'
-            db.session.commit()
+        response = client.post('/release_spot/1', headers={'Idempotency-Key': 'release-1'}).get_json()
 
+        with self.app.app_context():
+            reservation = db.session.get(Reservation, 1)
+            spot = db.session.get(ParkingSpot, reservation.spot_id)
+            self.assertEqual(db.session.get(IdempotencyKey, (1, 'release-1')).created_at, datetime(2025, 11, 10, 11, 0, 0))
+            duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
             self.assertEqual(duration, 1.0)
-            self.assertEqual(total_cost, 50.00)
+            self.assertEqual(response['total_cost'], 50.00)
             self.assertEqual(reservation.parking_cost, 50.00)
             self.assertEqual(spot.status, 'A')
             print("test_4_release_spot_one_hour_cost passed")
 
-    @patch('controllers.parking_controller.datetime')
-    def test_4_release_spot_half_hour_cost(self, mock_datetime):
-        with self.app.app_context():
-            mock_datetime.utcnow.return_value = datetime(2025, 11, 10, 10, 30, 0)
-            
-            reservation = self.res1
-            reservation.leaving_timestamp = mock_datetime.utcnow()
-            duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600 
-            total_cost = round(duration * reservation.parking_cost, 2)
-            reservation.parking_cost = total_cost
+    def test_4_release_spot_half_hour_cost(self):
+        clock = SimulatedClock(datetime(2025, 11, 10, 10, 0, 0))
+        install_clock(self.app, clock)
+        self.app.register_blueprint(parking_bp)
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+            sess['is_admin'] = True
+        clock.advance(minutes=30)
+
+        details = client.get('/api/reservation-details/2').get_json()
+        with client.session_transaction() as sess:
+            sess['is_admin'] = False
+        response = client.post('/release_spot/1').get_json()
 
+        with self.app.app_context():
+            reservation = db.session.get(Reservation, 1)
+            duration = (reservation.leaving_timestamp - reservation.parking_timestamp).total_seconds() / 3600
             self.assertAlmostEqual(duration, 0.5, places=2)
-            self.assertEqual(total_cost, 25.00)
+            self.assertEqual(details['current_cost'], 25.00)
+            self.assertEqual(details['elapsed_time'], '0 hours, 30 minutes')
+            self.assertEqual(response['total_cost'], 25.00)
             self.assertEqual(reservation.parking_cost, 25.00)
             print("test_4_release_spot_half_hour_cost passed")
 
@@ -190,5 +223,630 @@ class TestParkoBusinessLogic(unittest.TestCase):
             self.assertEqual(ParkingLot.query.count(), initial_lot_count)
             print("test_5_delete_occupied_lot_fails_condition passed")
 
+    # UNIT 6: Incremental Report Export
+    def test_6_export_snapshot_skips_open_reservation(self):
+        with self.app.app_context(), tempfile.TemporaryDirectory() as out_dir:
+            closed = Reservation(spot_id=self.spot1.id, user_id=self.user1.id, vehicle_id=self.vehicle1.id,
+                parking_timestamp=datetime(2025, 11, 10, 9, 0, 0), leaving_timestamp=datetime(2025, 11, 10, 11, 30, 0), parking_cost=125.0)
+            db.session.add(closed)
+            db.session.commit()
+
+            # Reservation 1 is still open; the closed one after it is not held back.
+            self.assertEqual(export_snapshot(out_dir), 1)
+            self.assertEqual(build_report(out_dir)['watermark'], closed.id)
+
+            reservation = db.session.get(Reservation, self.res1.id)
+            reservation.leaving_timestamp = datetime(2025, 11, 10, 11, 0, 0)
+            reservation.parking_cost = 50.0
+            db.session.commit()
+
+            self.assertEqual(export_snapshot(out_dir), 1)
+            self.assertEqual(export_snapshot(out_dir), 0)
+            report = build_report(out_dir)
+            self.assertEqual(report['reservations'], 2)
+            self.assertEqual(report['monthly_revenue'], [('2025-11', 175.0)])
+            self.assertAlmostEqual(sum(map(sum, report['heatmap'])), 3.5)
+            self.assertEqual(dict(report['dwell_times'])['2-4h'], 1)
+            print("test_6_export_snapshot_skips_open_reservation passed")
+
+    # UNIT 7: Occupancy Forecast Refresh
+    def test_7_forecast_refresh_is_incremental(self):
+        with self.app.app_context():
+            reservation = db.session.get(Reservation, self.res1.id)
+            reservation.parking_timestamp = datetime(2025, 11, 10, 10, 30, 0)
+            reservation.leaving_timestamp = datetime(2025, 11, 10, 12, 30, 0)
+            db.session.commit()
+            now = datetime(2025, 11, 10, 9, 45, 0)
+
+            self.assertEqual(refresh_forecasts(now), 1)
+            self.assertEqual(refresh_forecasts(now), 0)
+            # 10:30-12:30 UTC is Monday 16:00-18:00 IST, so one spot fills up after 16:00.
+            self.assertEqual(hour_of_week(reservation.parking_timestamp), 16)
+            self.assertEqual(expected_free(self.lot1.id, 3, 0, 30, now), 3)
+            self.assertEqual(expected_free(self.lot1.id, 3, 0, 60, now), 2)
+
+            # A worker's cache picks up a refresh run elsewhere, and an open
+            # reservation does not hold back the closed ones after it.
+            worker_cache = ForecastCache(check_interval=0)
+            later = datetime(2025, 11, 10, 10, 30, 0)
+            self.assertEqual(worker_cache.expected_occupied(self.lot1.id, later, now), 1.0)
+            still_parked = Reservation(spot_id=self.spot1.id, user_id=self.user1.id, vehicle_id=self.vehicle1.id,
+                parking_timestamp=datetime(2025, 11, 10, 10, 0, 0))
+            left = Reservation(spot_id=self.spot1.id, user_id=self.user1.id, vehicle_id=self.vehicle1.id,
+                parking_timestamp=datetime(2025, 11, 10, 10, 30, 0), leaving_timestamp=datetime(2025, 11, 10, 11, 30, 0))
+            db.session.add_all([still_parked, left])
+            db.session.commit()
+            self.assertEqual(refresh_forecasts(now), 1)
+            self.assertEqual(worker_cache.expected_occupied(self.lot1.id, later, now), 2.0)
+            still_parked.leaving_timestamp = datetime(2025, 11, 10, 11, 0, 0)
+            db.session.commit()
+            self.assertEqual(refresh_forecasts(now), 1)
+            self.assertEqual(refresh_forecasts(now), 0)
+            print("test_7_forecast_refresh_is_incremental passed")
+
+    # UNIT 8: Idempotent Booking Replay
+    def test_8_duplicate_bookings_in_parallel_create_one_reservation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            app = Flask(__name__)
+            app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(tmp, 'idem.db')
+            app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+            app.config['SECRET_KEY'] = 'test_secret_key'
+            db.init_app(app)
+            app.register_blueprint(parking_bp)
+            with app.app_context():
+                db.create_all()
+            create_initial_data(app)
+
+            def book(_):
+                client = app.test_client()
+                with client.session_transaction() as sess:
+                    sess['user_id'] = 1
+                return client.post('/book_lot/1', json={'vehicle_id': 1}, headers={'Idempotency-Key': 'retry-1'})
+
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                responses = list(pool.map(book, range(8)))
+            replayed = book(None)
+
+            with app.app_context():
+                self.assertEqual(Reservation.query.count(), 2)
+                self.assertEqual(ParkingSpot.query.filter_by(lot_id=1, status='O').count(), 2)
+            # Duplicates that lost the race are rolled back and get the
+            # winner's response, so every client sees the same booking.
+            self.assertTrue(all(r.status_code == 200 for r in responses))
+            self.assertEqual(len({r.get_data() for r in responses + [replayed]}), 1)
+            self.assertEqual(replayed.headers.get('Idempotent-Replayed'), 'true')
+
+            # A failure before the final commit leaves neither the booking
+            # nor the key behind, so the retry books normally.
+            def crash(session):
+                raise RuntimeError('worker died')
+            client = app.test_client()
+            with client.session_transaction() as sess:
+                sess['user_id'] = 1
+            event.listen(db.Session, 'before_commit', crash)
+            try:
+                failed = client.post('/book_lot/1', json={'vehicle_id': 1}, headers={'Idempotency-Key': 'retry-2'})
+            finally:
+                event.remove(db.Session, 'before_commit', crash)
+            self.assertEqual(failed.status_code, 500)
+            with app.app_context():
+                self.assertEqual(Reservation.query.count(), 2)
+            retried = client.post('/book_lot/1', json={'vehicle_id': 1}, headers={'Idempotency-Key': 'retry-2'})
+            self.assertEqual(retried.status_code, 200)
+            self.assertIsNone(retried.headers.get('Idempotent-Replayed'))
+            with app.app_context():
+                self.assertEqual(Reservation.query.count(), 3)
+                db.session.remove()
+                db.engine.dispose()
+            print("test_8_duplicate_bookings_in_parallel_create_one_reservation passed")
+
+    # UNIT 9: Vehicle Registry Lookups and Invalidation
+    def test_9_vehicle_registry_tracks_mutations(self):
+        with self.app.app_context():
+            registry = get_registry()
+            self.assertTrue(registry.owned_by(1, self.user1.id))
+            self.assertFalse(registry.owned_by(1, 2))
+            self.assertTrue(registry.plate_taken('mh-12 a1000'))
+            self.assertFalse(registry.plate_taken('MH12A1000', exclude_id=1))
+
+            db.session.add(Vehicle(user_id=2, vehicle_number='KA05XY4321', vehicle_type='Bike'))
+            vehicle = db.session.get(Vehicle, 1)
+            vehicle.vehicle_number = 'MH12B2000'
+            db.session.commit()
+
+            self.assertEqual(normalize_plate(' ka-05 xy4321 '), 'KA05XY4321')
+            self.assertFalse(registry.plate_taken('MH12A1000'))
+            self.assertEqual([v.vehicle_number for v in registry.user_vehicles(2)], ['KA05XY4321'])
+            self.assertEqual(registry.search('12b2'), [1])
+            self.assertEqual(len(registry.search('KA')), 1)
+            self.assertEqual(registry.search('12'), [1])
+            self.assertEqual(registry.search('5X'), registry.search('KA'))
+            self.assertEqual(registry.search('XY43'), registry.search('KA'))
+
+            print("test_9_vehicle_registry_tracks_mutations passed")
+
+    def test_9_stale_registry_reloads_in_background(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app({
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'registry.db'),
+                'EVENT_LOG_DIR': None
+            })
+            with app.app_context():
+                db.create_all()
+            create_initial_data(app)
+            with app.app_context():
+                registry = get_registry()
+                self.assertEqual(registry.search('A10'), [1])
+                # Written by "another worker": this process is not told about it.
+                db.session.execute(db.insert(Vehicle), [
+                    {'user_id': 2, 'vehicle_number': f'MH12A10{i:02d}', 'vehicle_type': 'Car'} for i in range(1, 4)
+                ])
+                db.session.commit()
+                # The stale copy answers at once; one background reload catches up.
+                registry.max_age = 0
+                self.assertEqual(registry.search('A10'), [1])
+                registry.max_age = 300
+                deadline = time.monotonic() + 5
+                while len(registry.search('A10')) == 1 and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                self.assertEqual(len(registry.search('A10')), 4)
+                self.assertEqual(len(registry.search('A10', limit=2)), 2)
+                db.session.remove()
+                db.engine.dispose()
+        print("test_9_stale_registry_reloads_in_background passed")
+
+    # UNIT 10: Reservation Event Log Replay
+    def test_10_replay_restores_only_committed_events(self):
+        with self.app.app_context(), tempfile.TemporaryDirectory() as log_dir:
+            log = ReservationEventLog(log_dir)
+            # The writer died before this booking committed; the client never saw it.
+            log.append({'type': 'book', 'reservation_id': 8, 'spot_id': 1, 'user_id': 1, 'vehicle_id': 1,
+                'parking_timestamp': '2025-11-10T12:00:00', 'leaving_timestamp': None, 'parking_cost': 50.0})
+            released = log.append({'type': 'release', 'reservation_id': 1, 'spot_id': 2, 'user_id': 1, 'vehicle_id': 1,
+                'parking_timestamp': '2025-11-10T10:00:00', 'leaving_timestamp': '2025-11-10T11:00:00', 'parking_cost': 50.0})
+            booked = log.append({'type': 'book', 'reservation_id': 7, 'spot_id': 3, 'user_id': 1, 'vehicle_id': 1,
+                'parking_timestamp': '2025-11-10T12:00:00', 'leaving_timestamp': None, 'parking_cost': 50.0})
+            taken = log.append({'type': 'book', 'reservation_id': 9, 'spot_id': 3, 'user_id': 2, 'vehicle_id': 1,
+                'parking_timestamp': '2025-11-10T12:05:00', 'leaving_timestamp': None, 'parking_cost': 50.0})
+            log.resolve([released, booked, taken])
+            log.close()
+            with open(os.path.join(log_dir, 'events-000001.log'), 'ab') as f:
+                f.write(b'deadbeef {"type":"bo')
+
+            log = ReservationEventLog(log_dir)
+            self.assertEqual(log.append({'type': 'noop'}), 6)
+            self.assertEqual(replay_events(log), 2)
+            self.assertEqual(replay_events(log), 0)
+            log.close()
+
+            self.assertEqual(db.session.get(Reservation, 1).parking_cost, 50.0)
+            self.assertEqual(db.session.get(ParkingSpot, 2).status, 'A')
+            self.assertIsNone(db.session.get(Reservation, 7).leaving_timestamp)
+            self.assertEqual(db.session.get(ParkingSpot, 3).status, 'O')
+            self.assertIsNone(db.session.get(Reservation, 9))
+            self.assertIsNone(db.session.get(Reservation, 8))
+            self.assertEqual(db.session.get(ParkingSpot, 1).status, 'A')
+            print("test_10_replay_restores_only_committed_events passed")
+
+    def test_10_commits_advance_checkpoint_and_deleted_lots_stay_deleted(self):
+        with self.app.app_context(), tempfile.TemporaryDirectory() as root:
+            log = open_event_log(root, segment_size=1)
+            self.app.extensions['event_log'] = log
+            with self.assertRaises(BlockingIOError):
+                ReservationEventLog(log.directory)
+            other = open_event_log(root)
+            self.assertNotEqual(other.directory, log.directory)
+            other.close()
+
+            reservation = Reservation(spot_id=3, user_id=1, vehicle_id=1, parking_cost=50.0)
+            db.session.get(ParkingSpot, 3).status = 'O'
+            db.session.add(reservation)
+            commit_logged('book', reservation)
+            # The booking and its commit record, each in its own segment.
+            self.assertEqual(log.read_checkpoint(), 2)
+            self.assertFalse(log.pending())
+            self.assertEqual(len(log.segments()), 1)
+            replay_events(log, from_checkpoint=False)
+            self.assertEqual(Reservation.query.count(), 2)
+
+            db.session.delete(db.session.get(ParkingLot, 1))
+            db.session.commit()
+            self.assertEqual(replay_events(log, from_checkpoint=False), 0)
+            self.assertEqual(Reservation.query.count(), 0)
+            self.assertEqual(ParkingSpot.query.count(), 0)
+            log.close()
+            reopened = ReservationEventLog(log.directory)
+            self.assertEqual(reopened.append({'type': 'noop'}), 3)
+            reopened.close()
+            print("test_10_commits_advance_checkpoint_and_deleted_lots_stay_deleted passed")
+
+    # UNIT 11: Worker Startup Budget
+    def test_11_startup_within_budget(self):
+        timings = measure_startup(runs=5)
+
+        self.assertLess(timings['total'], STARTUP_BUDGET_SECONDS)
+        print("test_11_startup_within_budget passed")
+
+    # UNIT 12: Display Timezone Formatting
+    def test_12_format_local_handles_ist_and_dst(self):
+        parked = datetime(2025, 11, 10, 10, 0, 0)
+        self.assertEqual(format_local(parked), '2025-11-10 15:30')
+        self.assertEqual(format_local(None), '')
+        self.assertEqual(format_many([parked, None], '%H:%M', 'Europe/London'), ['10:00', ''])
+        # New York falls back from EDT to EST at 06:00 UTC on 2025-11-02.
+        self.assertEqual(format_local(datetime(2025, 11, 2, 5, 59), '%H:%M', 'America/New_York'), '01:59')
+        self.assertEqual(format_local(datetime(2025, 11, 2, 6, 0), '%H:%M', 'America/New_York'), '01:00')
+        print("test_12_format_local_handles_ist_and_dst passed")
+
+    def test_12_upgrade_adds_display_timezone_to_existing_database(self):
+        with self.app.app_context():
+            db.session.execute(db.text('ALTER TABLE user DROP COLUMN display_timezone'))
+            db.session.commit()
+            self.assertEqual(upgrade_schema(), ['user.display_timezone'])
+            self.assertEqual(upgrade_schema(), [])
+            self.assertIsNone(db.session.get(User, 1).display_timezone)
+            print("test_12_upgrade_adds_display_timezone_to_existing_database passed")
+
+    # UNIT 13: Waitlist Hand-over on Release
+    def test_13_release_hands_spot_to_waitlist_head(self):
+        self.app.register_blueprint(parking_bp)
+        with self.app.app_context():
+            db.session.add(Vehicle(id=2, user_id=2, vehicle_number='KA01B2000', vehicle_type='Car'))
+            for spot in ParkingSpot.query.filter_by(lot_id=1, status='A').all():
+                spot.status = 'O'
+            db.session.commit()
+        owner = self.app.test_client()
+        waiter = self.app.test_client()
+        with owner.session_transaction() as sess:
+            sess['user_id'] = 1
+        with waiter.session_transaction() as sess:
+            sess['user_id'] = 2
+
+        full = waiter.post('/book_lot/1', json={'vehicle_id': 2})
+        joined = waiter.post('/waitlist/1', json={'vehicle_id': 2}).get_json()
+        again = waiter.post('/waitlist/1', json={'vehicle_id': 2}).get_json()
+        self.app.extensions['waitlist_waiters'] = threading.BoundedSemaphore(0)
+        turned_away = waiter.get(f"/waitlist/entry/{joined['entry_id']}?wait=25")
+        del self.app.extensions['waitlist_waiters']
+        released = owner.post('/release_spot/1')
+        status = waiter.get(f"/waitlist/entry/{joined['entry_id']}?wait=1").get_json()
+
+        self.assertTrue(full.get_json()['waitlist'])
+        self.assertEqual(joined['position'], 1)
+        self.assertEqual(again['entry_id'], joined['entry_id'])
+        self.assertEqual(turned_away.get_json()['status'], 'waiting')
+        self.assertEqual(turned_away.headers['Retry-After'], '5')
+        self.assertEqual(released.status_code, 200)
+        self.assertEqual(status['status'], 'assigned')
+        self.assertEqual(status['spot_number'], 'C02')
+        with self.app.app_context():
+            reservation = db.session.get(Reservation, status['reservation_id'])
+            self.assertEqual(reservation.user_id, 2)
+            self.assertIsNone(reservation.leaving_timestamp)
+            self.assertEqual(db.session.get(ParkingSpot, 2).status, 'O')
+        print("test_13_release_hands_spot_to_waitlist_head passed")
+
+    def test_13_waitlist_skips_parked_and_stale_waiters(self):
+        with self.app.app_context():
+            db.session.add_all([
+                Vehicle(id=2, user_id=2, vehicle_number='KA01B2000', vehicle_type='Car'),
+                Vehicle(id=3, user_id=2, vehicle_number='KA01B3000', vehicle_type='Car')
+            ])
+            # Vehicle 1 is still parked in spot 2; vehicle 2's client stopped polling.
+            parked = WaitlistEntry(lot_id=1, user_id=1, vehicle_id=1, priority=2)
+            stale = WaitlistEntry(lot_id=1, user_id=2, vehicle_id=2, priority=1,
+                last_polled_at=utcnow() - timedelta(minutes=10))
+            live = WaitlistEntry(lot_id=1, user_id=2, vehicle_id=3)
+            db.session.add_all([parked, stale, live])
+            db.session.commit()
+
+            reservation = assign_next(db.session.get(ParkingSpot, 1))
+            db.session.commit()
+            self.assertEqual(reservation.vehicle_id, 3)
+            self.assertEqual([parked.status, stale.status, live.status], ['W', 'E', 'S'])
+
+            # Deleting a lot takes its reservations with it.
+            db.session.delete(reservation)
+            db.session.commit()
+            self.assertEqual(entry_payload(live), {'entry_id': live.id, 'lot_id': 1, 'status': 'assigned', 'position': 0})
+        print("test_13_waitlist_skips_parked_and_stale_waiters passed")
+
+    # UNIT 14: Incremental Admin Counters
+    def test_14_stats_follow_commits_without_queries(self):
+        with self.app.app_context():
+            stats = get_stats()
+            self.assertEqual(stats.totals()['occupied_spots'], 1)
+
+            db.session.get(ParkingSpot, 1).status = 'O'
+            db.session.delete(db.session.get(ParkingSpot, 3))
+            db.session.add(ParkingSpot(lot_id=2, spot_number='N01', status='A'))
+            db.session.add(User(username='user3', email='user3@test.com', password_hash='-'))
+            db.session.add(User(username='admin2', email='admin2@test.com', password_hash='-', is_admin=True))
+            db.session.commit()
+
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            totals = stats.totals()
+            lot1 = stats.lot(1)
+            event.remove(db.engine, 'before_cursor_execute', listener)
+            self.assertEqual(statements, [])
+            self.assertEqual(totals['total_spots'], 3)
+            self.assertEqual(totals['occupied_spots'], 2)
+            self.assertEqual(totals['total_users'], 3)
+            self.assertEqual(lot1, {'total_spots': 2, 'occupied_spots': 2, 'available_spots': 0})
+
+            db.session.execute(db.insert(ParkingSpot), [{'lot_id': 2, 'spot_number': 'N02', 'status': 'O'}])
+            db.session.commit()
+            self.assertEqual(stats.lot(2), {'total_spots': 2, 'occupied_spots': 1, 'available_spots': 1})
+        print("test_14_stats_follow_commits_without_queries passed")
+
+    # UNIT 15: Zone-aware Spot Allocation
+    def test_15_allocator_picks_nearest_fitting_spot_across_floors(self):
+        layout = generate_layout('T', 20, floors=2, row_length=5, sizes={0: 'S'})
+        allocator = LotAllocator([(i, spot['floor'], spot['distance'], spot['size_class'], 'A') for i, spot in enumerate(layout, 1)])
+        self.assertEqual(allocator.pick('Bike'), 1)
+        cars = [allocator.pick('Car') for _ in range(8)]
+        self.assertEqual(cars[:2], [2, 3])
+        occupied = {floor: counts[0] for floor, counts in allocator.floor_occupancy().items()}
+        self.assertTrue(occupied[0] >= occupied[1] > 0)
+        # No XL spot in this lot: a truck takes one of its largest spots.
+        self.assertEqual(allocator.layout(allocator.pick('Truck'))[2], 'M')
+        allocator.release(2)
+        self.assertEqual(allocator.pick('Car'), 2)
+
+        self.app.register_blueprint(parking_bp)
+        with self.app.app_context():
+            db.session.get(ParkingSpot, 1).distance = 10.0
+            db.session.get(ParkingSpot, 3).distance = 1.0
+            db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        first = client.post('/book_lot/1', json={'vehicle_id': 1}).get_json()
+        second = client.post('/book_lot/1', json={'vehicle_id': 1}).get_json()
+        full = client.post('/book_lot/1', json={'vehicle_id': 1}).get_json()
+        client.post(f"/release_spot/{first['reservation_id']}")
+        again = client.post('/book_lot/1', json={'vehicle_id': 1}).get_json()
+
+        self.assertEqual([first['spot_number'], second['spot_number']], ['C03', 'C01'])
+        self.assertTrue(full['waitlist'])
+        self.assertEqual(again['spot_number'], 'C03')
+        print("test_15_allocator_picks_nearest_fitting_spot_across_floors passed")
+
+    def test_15_every_vehicle_type_books_in_sample_lots(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'EVENT_LOG_DIR': None, 'SECRET_KEY': 'test'})
+        vehicle_types = ['', 'Car', 'Bike', 'SUV', 'Truck', 'Van', 'Other']
+        with app.app_context():
+            db.create_all()
+            create_sample_data()
+            driver = User(username='driver', email='driver@test.com', password_hash='-')
+            db.session.add(driver)
+            db.session.flush()
+            vehicles = [Vehicle(user_id=driver.id, vehicle_number=f'TYPE{i:02d}', vehicle_type=vehicle_type)
+                        for i, vehicle_type in enumerate(vehicle_types)]
+            db.session.add_all(vehicles)
+            db.session.commit()
+            driver_id = driver.id
+            vehicle_ids = [vehicle.id for vehicle in vehicles]
+            lot_ids = [lot_id for lot_id, in db.session.query(ParkingLot.id)]
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = driver_id
+
+        for lot_id in lot_ids:
+            for vehicle_id, vehicle_type in zip(vehicle_ids, vehicle_types):
+                booked = client.post(f'/book_lot/{lot_id}', json={'vehicle_id': vehicle_id})
+                self.assertEqual(booked.status_code, 200, (lot_id, vehicle_type, booked.get_json()))
+                client.post(f"/release_spot/{booked.get_json()['reservation_id']}")
+        with app.app_context():
+            ParkingSpot.query.filter_by(lot_id=lot_ids[0]).update({'size_class': 'M'})
+            db.session.commit()
+        truck = client.post(f'/book_lot/{lot_ids[0]}', json={'vehicle_id': vehicle_ids[vehicle_types.index('Truck')]})
+        self.assertEqual(truck.status_code, 200)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        print("test_15_every_vehicle_type_books_in_sample_lots passed")
+
+    def test_15_admin_resizes_spots_and_booking_checks_size(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'EVENT_LOG_DIR': None, 'SECRET_KEY': 'test'})
+        with app.app_context():
+            db.create_all()
+        create_initial_data(app)
+        admin = app.test_client()
+        with admin.session_transaction() as sess:
+            sess['is_admin'] = True
+        form = {'name': 'Central', 'address': '123 St', 'pin_code': '10001', 'price': '50', 'new_spots': '2'}
+        self.assertEqual(admin.post('/admin/edit_lot/1', data=dict(form, row_sizes='S M Q')).status_code, 200)
+        self.assertEqual(admin.post('/admin/edit_lot/1', data=dict(form, row_sizes='s m m m xl')).status_code, 302)
+        with app.app_context():
+            spots = ParkingSpot.query.filter_by(lot_id=1).order_by(ParkingSpot.id).all()
+            self.assertEqual([(spot.spot_number, spot.size_class) for spot in spots],
+                             [('C01', 'S'), ('C02', 'M'), ('C03', 'M'), ('C04', 'M'), ('C05', 'XL')])
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        too_small = client.post('/book_spot/1', json={'vehicle_id': 1})
+        fits = client.post('/book_spot/3', json={'vehicle_id': 1})
+        self.assertEqual(too_small.status_code, 400)
+        self.assertEqual(fits.status_code, 200)
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        print("test_15_admin_resizes_spots_and_booking_checks_size passed")
+
+    def test_15_upgrade_lays_out_spots_of_an_older_database(self):
+        with self.app.app_context():
+            db.session.execute(db.text('DROP INDEX ix_spot_lot_status'))
+            for column in ('floor', 'zone', 'distance', 'size_class'):
+                db.session.execute(db.text(f'ALTER TABLE parking_spot DROP COLUMN {column}'))
+            db.session.commit()
+            db.session.expire_all()
+
+            added = upgrade_schema()
+            spots = ParkingSpot.query.filter_by(lot_id=1).order_by(ParkingSpot.id).all()
+
+            self.assertEqual(added, ['parking_spot.floor', 'parking_spot.zone', 'parking_spot.distance',
+                                     'parking_spot.size_class', 'ix_spot_lot_status'])
+            # Sizes are left to an explicit re-size by an admin.
+            self.assertEqual([spot.size_class for spot in spots], ['M', 'M', 'M'])
+            self.assertEqual([spot.distance for spot in spots], [0.0, 2.5, 5.0])
+            self.assertEqual([spot.spot_number for spot in spots], ['C01', 'C02', 'C03'])
+            self.assertEqual(upgrade_schema(), [])
+            print("test_15_upgrade_lays_out_spots_of_an_older_database passed")
+
+    # UNIT 16: Read-replica Routing and Read-your-writes
+    def test_16_read_only_views_use_replica_until_user_writes(self):
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                app = create_app({
+                    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'primary.db'),
+                    'SQLALCHEMY_BINDS': {'replica': 'sqlite:///' + os.path.join(tmp, 'replica.db')},
+                    'EVENT_LOG_DIR': None,
+                    'TESTING': True
+                })
+                with app.app_context():
+                    db.create_all()
+                    create_initial_data(app)
+                    self.assertEqual(app.test_cli_runner().invoke(args=['snapshot-replica', 'replica']).exit_code, 0)
+                    db.session.add(ParkingSpot(lot_id=2, spot_number='N01', status='A'))
+                    db.session.commit()
+
+                    db.session.info['read_only'] = True
+                    self.assertEqual(ParkingSpot.query.count(), 3)
+                    db.session.info.pop('read_only')
+                    self.assertEqual(ParkingSpot.query.count(), 4)
+                    self.assertLess(get_monitor().lags(db)['replica'], 5)
+
+                client = app.test_client()
+                with client.session_transaction() as sess:
+                    sess['user_id'] = 1
+                self.assertEqual(client.get('/lot/2').status_code, 200)
+                self.assertTrue(client.post('/book_lot/2', json={'vehicle_id': 1}).get_json()['success'])
+                with client.session_transaction() as sess:
+                    self.assertGreater(sess['primary_until'], datetime.now().timestamp())
+
+                with app.app_context():
+                    with db.engines['replica'].begin() as connection:
+                        connection.execute(db.text("UPDATE replica_heartbeat SET beat_at = '2000-01-01 00:00:00'"))
+                    beat = db.session.execute(db.text('SELECT beat_at FROM replica_heartbeat')).scalar()
+                    self.assertGreater(get_monitor().check(db)['replica'], 30)
+                    self.assertEqual(db.session.execute(db.text('SELECT beat_at FROM replica_heartbeat')).scalar(), beat)
+                    self.assertIsNone(get_monitor().next_replica(db))
+                    db.session.info['read_only'] = True
+                    self.assertEqual(ParkingSpot.query.count(), 4)
+                    db.session.remove()
+                    db.engine.dispose()
+                    db.engines['replica'].dispose()
+        finally:
+            # db is shared with setUp's app, whose teardown must not see the replica bind.
+            db.metadatas.pop('replica', None)
+        print("test_16_read_only_views_use_replica_until_user_writes passed")
+
+    # UNIT 17: Capacity Simulation on a Simulated Clock
+    def test_17_simulation_books_and_releases_consistently(self):
+        simulation = Simulation(users=20, spots=5, floors=1, hours=6, visits_per_day=4, mean_stay_hours=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            simulation.setup(os.path.join(tmp, 'simulation.db'))
+            simulation.run()
+            with simulation.app.app_context():
+                occupied = ParkingSpot.query.filter_by(lot_id=simulation.lot_id, status='O').count()
+                open_reservations = Reservation.query.filter_by(leaving_timestamp=None).count()
+                latest = db.session.query(db.func.max(Reservation.parking_timestamp)).scalar()
+                db.session.remove()
+                db.engine.dispose()
+        self.assertGreater(simulation.counts['bookings'], 0)
+        self.assertEqual(simulation.counts['bookings'] - simulation.counts['releases'], len(simulation.parked))
+        self.assertEqual(occupied, len(simulation.parked))
+        self.assertEqual(open_reservations, len(simulation.parked))
+        self.assertLess(latest, simulation.horizon)
+        self.assertIn('DB hot spots', simulation.summary())
+        print("test_17_simulation_books_and_releases_consistently passed")
+
+    # UNIT 18: SQLite Pragmas per App Engine
+    def test_18_sqlite_pragmas_apply_to_app_engines_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            app = create_app({
+                'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'app.db'),
+                'EVENT_LOG_DIR': None
+            })
+            with app.app_context():
+                with db.engine.connect() as connection:
+                    self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'wal')
+                    self.assertEqual(connection.exec_driver_sql('PRAGMA busy_timeout').scalar(), 5000)
+                    # Durability is left at SQLite's default (FULL).
+                    self.assertEqual(connection.exec_driver_sql('PRAGMA synchronous').scalar(), 2)
+                db.engine.dispose()
+            other = create_engine('sqlite:///' + os.path.join(tmp, 'other.db'))
+            with other.connect() as connection:
+                self.assertEqual(connection.exec_driver_sql('PRAGMA journal_mode').scalar(), 'delete')
+            other.dispose()
+        print("test_18_sqlite_pragmas_apply_to_app_engines_only passed")
+
+    # UNIT 19: Lots Sharded Across Databases
+    def test_19_new_lot_goes_to_emptiest_shard_and_reports_cover_all(self):
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                app = create_app({
+                    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(tmp, 'primary.db'),
+                    'SQLALCHEMY_BINDS': {'shard1': 'sqlite:///' + os.path.join(tmp, 'shard1.db')},
+                    'EVENT_LOG_DIR': None,
+                    'SECRET_KEY': 'test'
+                })
+                with app.app_context():
+                    db.create_all()
+                    create_shard_tables(db)
+                create_initial_data(app)
+
+                admin = app.test_client()
+                with admin.session_transaction() as sess:
+                    sess['is_admin'] = True
+                created = admin.post('/admin/create_lot', data={
+                    'name': 'East', 'address': '789 Rd', 'pin_code': '10003', 'price': '20', 'spots': '3'
+                })
+                self.assertEqual(created.status_code, 302)
+                with app.app_context():
+                    self.assertIsNone(ParkingLot.query.filter_by(prime_location_name='East').first())
+                    with on_shard(db.session, 1):
+                        lot = ParkingLot.query.filter_by(prime_location_name='East').one()
+                        lot_id = lot.id
+                        spot_ids = [spot.id for spot in lot.spots]
+                self.assertGreaterEqual(lot_id, SHARD_ID_SPAN)
+                self.assertTrue(all(spot_id > SHARD_ID_SPAN for spot_id in spot_ids))
+
+                client = app.test_client()
+                with client.session_transaction() as sess:
+                    sess['user_id'] = 1
+                booked = client.post(f'/book_lot/{lot_id}', json={'vehicle_id': 1}).get_json()
+                self.assertTrue(booked['success'])
+                self.assertGreater(booked['reservation_id'], SHARD_ID_SPAN)
+                self.assertIn(b'East', client.get('/dashboard').data)
+                self.assertTrue(client.post(f'/release_spot/{booked["reservation_id"]}').get_json()['success'])
+                summary = client.get('/summary')
+                self.assertEqual(summary.status_code, 200)
+                self.assertIn(b'East', summary.data)
+
+                dashboard = admin.get('/admin/dashboard')
+                self.assertIn(b'Central', dashboard.data)
+                self.assertIn(b'East', dashboard.data)
+                with app.app_context():
+                    totals = get_stats().totals()
+                    self.assertEqual(totals['total_lots'], 3)
+                    self.assertEqual(totals['total_spots'], 6)
+                    self.assertEqual(totals['total_reservations'], 2)
+                    out_dir = os.path.join(tmp, 'reports')
+                    self.assertEqual(export_snapshot(out_dir), 1)
+                    self.assertEqual(build_report(out_dir)['watermark'], booked['reservation_id'])
+                    self.assertEqual(export_snapshot(out_dir), 0)
+                    self.assertEqual(refresh_forecasts(), 1)
+                    db.session.remove()
+                    for engine in db.engines.values():
+                        engine.dispose()
+        finally:
+            db.metadatas.pop('shard1', None)
+        print("test_19_new_lot_goes_to_emptiest_shard_and_reports_cover_all passed")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file